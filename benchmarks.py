@@ -0,0 +1,531 @@
+#! /usr/bin/env python
+"""
+Benchmarks for the slow parts of the game.  Run it from the top of the repo:
+
+    python benchmarks.py load
+    python benchmarks.py flips
+    python benchmarks.py backgrounds
+    python benchmarks.py enemies
+    python benchmarks.py bullets
+    python benchmarks.py spawn
+    python benchmarks.py start
+
+`suite` measures everything (load time and memory per map, per-frame update
+and draw cost, and a few micro-benchmarks) and saves the results as JSON, so
+that runs on different commits can be compared:
+
+    python benchmarks.py suite -o before.json
+    # ... change something ...
+    python benchmarks.py suite -o after.json
+    python benchmarks.py compare before.json after.json
+
+Every benchmark runs without opening a window or playing sounds, using SDL's
+dummy video and audio drivers.
+"""
+from __future__ import division, print_function
+
+# builtins
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+# Third-party
+import pygame
+
+# First-party
+import game
+from lib import tmx, images, assets, headless, collision, pyganim
+from lib import sprites
+from lib.keymap import km1
+
+MAPS_DIRECTORY = 'maps'
+BACKGROUNDS_DIRECTORY = os.path.join('images', 'backgrounds')
+VIEWPORT = (640, 480)
+
+# what the suite measures the per-frame cost with.
+VIEWPORTS = [(640, 480), (1280, 720), (1920, 1080)]
+ENEMY_COUNTS = [0, 10, 50]
+CHARACTER = 'megaman'
+
+# how many enemies `enemies` updates at once.
+SWARM_SIZES = [100, 1000, 2000]
+
+# how many bullets `bullets` fires into each crowd of enemies.
+VOLLEY_SIZES = [1, 10, 50]
+
+# how many enemies `spawn` makes.
+SPAWN_COUNT = 500
+
+# the map the micro-benchmarks use.
+MICRO_MAP = os.path.join(MAPS_DIRECTORY, 'map1.tmx')
+
+# `compare` flags anything that got more than this much slower (or bigger).
+DEFAULT_THRESHOLD = 0.1
+
+
+def mean_time(function, repeat):
+    """Return the mean wall-clock time of `repeat` calls to function."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def map_files(names=None):
+    """Return the map files, or only the ones called one of `names`."""
+    return sorted(os.path.join(MAPS_DIRECTORY, m)
+                  for m in os.listdir(MAPS_DIRECTORY)
+                  if m.endswith('.tmx') and (not names or m in names))
+
+
+def make_game(filename, viewport, enemies):
+    """
+    Set up a Game on the map `filename` like Game.main does, without sounds,
+    and with `enemies` enemies spread over the map's enemy spawn points.
+    Returns None if the map has nowhere to put them.
+    """
+    g = game.Game()
+    g.tilemap = tmx.load(filename, viewport)
+    g.animation_clock = pyganim.default_clock = pyganim.AnimationClock()
+    g.jump = g.shoot = g.explosion = headless.SilentSound()
+    triggers = g.tilemap.layers['triggers']
+    spawns = triggers.find('enemy')
+    if enemies and not spawns:
+        return None
+
+    start = triggers.find('player')[0]
+    g.sprites = tmx.SpriteLayer()
+    g.bullet_pool = sprites.BulletPool(g.sprites)
+    g.players = [sprites.Player((start.px, start.py), km1, CHARACTER, g.sprites)]
+    g.tilemap.layers.append(g.sprites)
+
+    g.enemies = sprites.EnemyLayer()
+    for i in range(enemies):
+        spawn = spawns[i % len(spawns)]
+        sprites.Enemy((spawn.px, spawn.py), spawn['enemy'], g.enemies)
+    g.tilemap.layers.append(g.enemies)
+    g.blockers = collision.BlockerGrid(triggers, g.tilemap.tile_width)
+    return g
+
+
+def frame_times(g, screen, frames):
+    """
+    Play `frames` frames of g, with the player walking back and forth,
+    jumping and shooting.  Return the mean (update, draw) time per frame.
+    """
+    player = g.players[0]
+    dt = 1 / g.FPS
+    update = draw = 0
+    for frame in range(frames):
+        player.moving = player.WALKING
+        player.direction = player.RIGHT if (frame // 90) % 2 == 0 else player.LEFT
+        if frame % 45 == 0:
+            player.jump = True
+        if frame % 20 == 0:
+            player.shoot = True
+
+        start = time.perf_counter()
+        g.step(dt)
+        middle = time.perf_counter()
+        g.tilemap.draw(screen)
+        end = time.perf_counter()
+        update += middle - start
+        draw += end - middle
+    return update / frames, draw / frames
+
+
+def bench_load(args):
+    """Compare parsing each map's XML with loading its compiled cache."""
+    print('{:<30} {:>10} {:>10} {:>8}'.format('map', 'xml (ms)', 'cache (ms)', 'speedup'))
+    total_xml = total_cache = 0
+    for filename in map_files():
+        xml = mean_time(lambda: tmx.load(filename, VIEWPORT), args.repeat)
+        # make sure the cache is there and current before timing it.
+        tmx.load(filename, VIEWPORT, cache=True)
+        cache = mean_time(lambda: tmx.TileMap.load_cache(filename, VIEWPORT), args.repeat)
+        total_xml += xml
+        total_cache += cache
+        print('{:<30} {:>10.1f} {:>10.1f} {:>7.1f}x'.format(
+            os.path.basename(filename), xml * 1000, cache * 1000, xml / cache))
+    print('{:<30} {:>10.1f} {:>10.1f} {:>7.1f}x'.format(
+        'total', total_xml * 1000, total_cache * 1000, total_xml / total_cache))
+
+
+def bench_flips(args):
+    """Show how much the shared flipped tile cache saves on each map."""
+    print('{:<30} {:>8} {:>9} {:>10} {:>10} {:>10}'.format(
+        'map', 'flipped', 'variants', 'KiB saved', 'old (ms)', 'new (ms)'))
+    for filename in map_files():
+        tilemap = tmx.load(filename, VIEWPORT)
+        layers = [l for l in tilemap.layers if isinstance(l, tmx.Layer)]
+        flipped = [gid for layer in layers for gid in layer.cells.gids
+                   if gid & ~tmx.GID_PART]
+
+        # the old loader made a new flipped Tile for every single cell.
+        old = mean_time(lambda: [tmx.make_flipped_tile(tilemap.tilesets, gid)
+                                 for gid in flipped], args.repeat)
+        def shared():
+            for gid in set(flipped):
+                tilemap.tilesets.pop(gid, None)
+            for gid in flipped:
+                tilemap.tilesets[gid]
+        new = mean_time(shared, args.repeat)
+
+        variants = len(set(flipped))
+        tile_bytes = tilemap.tile_width * tilemap.tile_height * 4
+        print('{:<30} {:>8} {:>9} {:>10.1f} {:>10.2f} {:>10.2f}'.format(
+            os.path.basename(filename), len(flipped), variants,
+            (len(flipped) - variants) * tile_bytes / 1024, old * 1000, new * 1000))
+
+
+def bench_backgrounds(args):
+    """Compare decoding and scaling each background with the disk cache."""
+    sizes = [VIEWPORT, (1920, 1080)]
+    print('{:<26} {:>10} {:>10} {:>10} {:>8}'.format(
+        'background', 'size', 'old (ms)', 'new (ms)', 'speedup'))
+    for name in sorted(os.listdir(BACKGROUNDS_DIRECTORY)):
+        path = os.path.join(BACKGROUNDS_DIRECTORY, name)
+        for size in sizes:
+            # a new image cache for every call, like a fresh start of the game.
+            old = mean_time(lambda: images.image_cacher()(path, size=size, convert=True),
+                            args.repeat)
+            # make sure the disk cache is there before timing it.
+            images.load_background(path, size, loader=images.image_cacher())
+            new = mean_time(lambda: images.load_background(path, size, loader=images.image_cacher()),
+                            args.repeat)
+            print('{:<26} {:>10} {:>10.2f} {:>10.2f} {:>7.1f}x'.format(
+                name, '{}x{}'.format(*size), old * 1000, new * 1000, old / new))
+
+
+def bench_enemies(args):
+    """Compare updating a crowd of enemies one at a time with batching them."""
+    if not sprites.EnemyLayer.batched:
+        sys.exit('batching enemies needs NumPy.')
+    print('{:>8} {:>12} {:>12} {:>8}'.format('enemies', 'old (ms)', 'new (ms)', 'speedup'))
+    for size in SWARM_SIZES:
+        g = make_game(MICRO_MAP, VIEWPORT, size)
+        dt = 1 / g.FPS
+        def update():
+            for _ in range(args.frames):
+                g.enemies.update(dt, g)
+        g.enemies.batched = False
+        old = mean_time(update, args.repeat) / args.frames
+        g.enemies.batched = True
+        new = mean_time(update, args.repeat) / args.frames
+        print('{:>8} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(size, old * 1000, new * 1000, old / new))
+
+
+def bench_bullets(args):
+    """Compare checking every enemy for what each bullet hits with the broad phase."""
+    print('{:>8} {:>8} {:>12} {:>12} {:>8}'.format('enemies', 'bullets', 'old (ms)', 'new (ms)', 'speedup'))
+    for size in SWARM_SIZES:
+        g = make_game(MICRO_MAP, VIEWPORT, size)
+        enemies = g.enemies.sprites()
+        # spread them over the map, instead of stacked on the spawn points.
+        for i, enemy in enumerate(enemies):
+            enemy.rect.x = i * g.tilemap.px_width // size
+        for volley in VOLLEY_SIZES:
+            # bullets spread over the enemies, the way a fight would have them.
+            rects = [enemies[i * len(enemies) // volley].rect.move(0, 10).inflate(-30, -30)
+                     for i in range(volley)]
+            def old():
+                for rect in rects:
+                    [enemy for enemy in g.enemies if rect.colliderect(enemy.rect)]
+            def new():
+                # one update's worth: the enemies moved, then the bullets check them.
+                g.enemies.broad_phase.invalidate()
+                for rect in rects:
+                    g.enemies.collide(rect)
+            old_time = mean_time(old, args.repeat * 20)
+            new_time = mean_time(new, args.repeat * 20)
+            print('{:>8} {:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+                size, volley, old_time * 1000, new_time * 1000, old_time / new_time))
+
+
+class UnsharedEnemy(sprites.Enemy):
+    """An Enemy that makes its own animations, the way every Enemy used to."""
+    def init_animations(self, enemy):
+        images = type(self)._get_image_files.__wrapped__(type(self), enemy)
+        self.anim_walk_left = pyganim.PygAnimation([(image, .15) for image in images], convert=False)
+        self.anim_walk_right = pyganim.PygAnimation([(image, .15) for image in images], convert=False, flip=(True, False))
+        self.image = self.anim_walk_left.getCurrentFrame()
+
+
+def bench_spawn(args):
+    """Compare spawning enemies with their own animations with sharing clips."""
+    tilemap = tmx.load(MICRO_MAP, VIEWPORT)
+    spawns = tilemap.layers['triggers'].find('enemy')
+    def spawn(enemy_class):
+        layer = sprites.EnemyLayer()
+        for i in range(SPAWN_COUNT):
+            cell = spawns[i % len(spawns)]
+            enemy_class((cell.px, cell.py), cell['enemy'], layer)
+        return layer
+    def allocated(enemy_class):
+        # the memory the enemies hold on to once they're made.
+        tracemalloc.start()
+        layer = spawn(enemy_class)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'enemies', 'old (ms)', 'new (ms)', 'old (KiB)', 'new (KiB)'))
+    old = mean_time(lambda: spawn(UnsharedEnemy), args.repeat)
+    new = mean_time(lambda: spawn(sprites.Enemy), args.repeat)
+    print('{:>8} {:>12.2f} {:>12.2f} {:>12.1f} {:>12.1f}'.format(
+        SPAWN_COUNT, old * 1000, new * 1000,
+        allocated(UnsharedEnemy) / 1024, allocated(sprites.Enemy) / 1024))
+
+
+def bench_start(args):
+    """
+    Compare how long each level takes to start with and without preloading
+    it, and after the menu has prefetched it.
+    """
+    screen = pygame.display.get_surface()
+    prefetcher = assets.Prefetcher(screen.get_size(), game.level_manifest)
+    print('{:<30} {:>12} {:>12} {:>15}'.format('map', 'old (ms)', 'new (ms)', 'prefetched (ms)'))
+    for filename in map_files(args.map):
+        # frames=0 returns just before the first frame.
+        settings = {'level': filename, 'players': 1, 'character': CHARACTER, 'frames': 0}
+        def start(preload):
+            # start from an empty image cache, like a fresh launch would.
+            images.load.clear()
+            g = game.Game()
+            if preload:
+                g.preload(screen, settings)
+            g.main(screen, settings)
+        def start_prefetched():
+            images.load.clear()
+            prefetcher.prefetch(filename, CHARACTER)
+            # the player lingers on the level in the menu until it's loaded...
+            prefetcher.levels[filename, CHARACTER].result().wait()
+            # ...then presses Start.
+            start = time.perf_counter()
+            g = game.Game()
+            g.prefetcher = prefetcher
+            g.preload(screen, settings)
+            g.main(screen, settings)
+            return time.perf_counter() - start
+        old = mean_time(lambda: start(False), args.repeat)
+        new = mean_time(lambda: start(True), args.repeat)
+        prefetched = sum(start_prefetched() for _ in range(args.repeat)) / args.repeat
+        print('{:<30} {:>12.1f} {:>12.1f} {:>15.1f}'.format(
+            os.path.basename(filename), old * 1000, new * 1000, prefetched * 1000))
+
+
+def record(results, name, value):
+    """Add a measurement to results, and show it."""
+    results[name] = value
+    print('{:<60} {:>14.6g}'.format(name, value))
+
+
+def suite_load(args, results):
+    # Note that tracemalloc only sees memory allocated by Python, not the
+    # pixels SDL allocates for surfaces.
+    for filename in map_files(args.map):
+        name = os.path.basename(filename)
+        record(results, 'load/{}/seconds'.format(name),
+               mean_time(lambda: tmx.load(filename, VIEWPORT), args.repeat))
+        tracemalloc.start()
+        tmx.load(filename, VIEWPORT)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        record(results, 'load/{}/peak_bytes'.format(name), peak)
+
+
+def suite_frames(args, results):
+    for filename in map_files(args.map):
+        name = os.path.basename(filename)
+        for viewport in VIEWPORTS:
+            screen = pygame.Surface(viewport).convert()
+            for enemies in ENEMY_COUNTS:
+                g = make_game(filename, viewport, enemies)
+                if g is None:
+                    continue
+                update, draw = frame_times(g, screen, args.frames)
+                prefix = 'frame/{}/{}x{}/{}_enemies/'.format(name, viewport[0], viewport[1], enemies)
+                record(results, prefix + 'update_seconds', update)
+                record(results, prefix + 'draw_seconds', draw)
+
+
+def suite_micro(args, results):
+    # these all report the time per call.
+    tilemap = tmx.load(MICRO_MAP, VIEWPORT)
+    width, height = VIEWPORT
+    regions = [(x, y, x + width, y + height)
+               for x in range(0, tilemap.px_width, width // 2)
+               for y in range(0, tilemap.px_height, height // 2)]
+    layers = [l for l in tilemap.layers if isinstance(l, tmx.Layer)]
+    def get_in_region():
+        for layer in layers:
+            for region in regions:
+                layer.get_in_region(*region)
+    record(results, 'micro/Layer.get_in_region/seconds',
+           mean_time(get_in_region, args.repeat) / (len(layers) * len(regions)))
+
+    triggers = tilemap.layers['triggers']
+    rects = [pygame.Rect(x, y, 44, 55)
+             for x in range(0, tilemap.px_width, 64)
+             for y in range(0, tilemap.px_height, 64)]
+    def collide():
+        for rect in rects:
+            triggers.collide(rect, 'blockers')
+    record(results, 'micro/ObjectLayer.collide/seconds',
+           mean_time(collide, args.repeat) / len(rects))
+
+    grid = collision.BlockerGrid(triggers, tilemap.tile_width)
+    def grid_collide():
+        for rect in rects:
+            grid.collide(rect)
+    record(results, 'micro/BlockerGrid.collide/seconds',
+           mean_time(grid_collide, args.repeat) / len(rects))
+
+    player = sprites.Player((0, 0), km1, CHARACTER, tmx.SpriteLayer())
+    walk_files = sprites.Player._get_image_files(CHARACTER)[0]
+    animation = pyganim.PygAnimation([(image, .1) for image in walk_files])
+    animation.play()
+    playhead = player.anim_walk_right
+    playhead.play()
+    calls = 1000
+    def get_current_frame():
+        for _ in range(calls):
+            animation.getCurrentFrame()
+    record(results, 'micro/PygAnimation.getCurrentFrame/seconds',
+           mean_time(get_current_frame, args.repeat) / calls)
+    def playhead_frame():
+        for _ in range(calls):
+            playhead.getCurrentFrame()
+    record(results, 'micro/Playhead.getCurrentFrame/seconds',
+           mean_time(playhead_frame, args.repeat) / calls)
+    def flip_twice():
+        for _ in range(calls):
+            animation.flip(True, False)
+            animation.flip(True, False)
+    record(results, 'micro/PygAnimation.flip/seconds',
+           mean_time(flip_twice, args.repeat) / (2 * calls))
+
+    spawn = tilemap.layers['triggers'].find('enemy')[0]
+    def make_enemies():
+        layer = sprites.EnemyLayer()
+        for _ in range(calls):
+            sprites.Enemy((spawn.px, spawn.py), spawn['enemy'], layer)
+    record(results, 'micro/Enemy.__init__/seconds',
+           mean_time(make_enemies, args.repeat) / calls)
+
+    image_keys = sprites.Player.image_keys(CHARACTER)
+    def load_cached():
+        for path, kwargs in image_keys:
+            images.load(path, **kwargs)
+    def load_uncached():
+        load = images.image_cacher()
+        for path, kwargs in image_keys:
+            load(path, **kwargs)
+    record(results, 'micro/images.load/cached_seconds',
+           mean_time(load_cached, args.repeat) / len(image_keys))
+    record(results, 'micro/images.load/uncached_seconds',
+           mean_time(load_uncached, args.repeat) / len(image_keys))
+
+
+def bench_suite(args):
+    """Run all the measurements and save them as JSON to args.output."""
+    results = {}
+    suite_load(args, results)
+    suite_frames(args, results)
+    suite_micro(args, results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('saved {} results to {}'.format(len(results), args.output))
+
+
+def bench_compare(args):
+    """
+    Compare two suite results files, and exit with status 1 if anything got
+    worse by more than args.threshold.  Every measurement is better lower.
+    """
+    if len(args.files) != 2:
+        sys.exit('compare needs two results files: old and new.')
+    with open(args.files[0]) as f:
+        old = json.load(f)
+    with open(args.files[1]) as f:
+        new = json.load(f)
+
+    regressions = 0
+    print('{:<60} {:>12} {:>12} {:>8}'.format('measurement', 'old', 'new', 'change'))
+    for name in sorted(set(old) & set(new)):
+        if old[name] == 0:
+            continue
+        change = new[name] / old[name] - 1
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{:<60} {:>12.6g} {:>12.6g} {:>+7.1%}{}'.format(
+            name, old[name], new[name], change, flag))
+    for name in sorted(set(old) ^ set(new)):
+        print('{:<60} only in {}'.format(name, args.files[0] if name in old else args.files[1]))
+
+    print('{} regression(s) over {:.0%}'.format(regressions, args.threshold))
+    if regressions:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    'backgrounds': bench_backgrounds,
+    'bullets': bench_bullets,
+    'compare': bench_compare,
+    'enemies': bench_enemies,
+    'flips': bench_flips,
+    'load': bench_load,
+    'spawn': bench_spawn,
+    'start': bench_start,
+    'suite': bench_suite,
+}
+
+
+def get_clargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark',
+                        help="Which benchmark to run.",
+                        choices=sorted(BENCHMARKS))
+
+    parser.add_argument('-r', '--repeat',
+                        help="How many times to repeat each measurement.",
+                        type=int,
+                        default=5)
+
+    parser.add_argument('files',
+                        help="The old and new results files to compare.",
+                        nargs='*')
+
+    parser.add_argument('-m', '--map',
+                        help="Only measure this map (can be given more than once).",
+                        action='append')
+
+    parser.add_argument('-f', '--frames',
+                        help="How many frames to measure update and draw over.",
+                        type=int,
+                        default=120)
+
+    parser.add_argument('-o', '--output',
+                        help="Where suite saves its results.",
+                        default='benchmarks.json')
+
+    parser.add_argument('-t', '--threshold',
+                        help="How much slower counts as a regression in compare (0.1 is 10%%).",
+                        type=float,
+                        default=DEFAULT_THRESHOLD)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    pygame.init()
+    pygame.display.set_mode(VIEWPORT)
+    args = get_clargs()
+    BENCHMARKS[args.benchmark](args)
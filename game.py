@@ -9,7 +9,9 @@ from __future__ import division
 # builtins
 import argparse
 import configparser
+import json
 import logging
+import multiprocessing
 import os
 
 # Third-party
@@ -17,9 +19,13 @@ import pygame
 
 # First-party
 from lib.keymap import km1, km2
-from lib import tmx, menu, images
+from lib import tmx, menu, images, assets, atlas, collision, headless, profiler, pyganim, render
 from lib import sprites
 
+# tilesets load their images through the image cache, so they use the ones
+# Game.preload decoded.
+tmx.load_image = images.load
+
 __author__ = 'Cody Piersall'
 
 # screen size when '--small' option is passed via command line.s
@@ -33,6 +39,11 @@ CHARACTERS_DIRECTORY = os.path.join('images', 'sprites', 'players')
 BACKGROUNDS_DIRECTORY = os.path.join('images', 'backgrounds')
 DEFAULT_BACKGROUND = 'black.bmp'
 
+# sound effects
+SOUNDS = {'jump': os.path.join('sounds', 'jump.wav'),
+          'shoot': os.path.join('sounds', 'shoot.wav'),
+          'explosion': os.path.join('sounds', 'explosion.wav')}
+
 
 # Fallback defaults for when no .gameconfig file is available
 DEFAULT_PLAYERS = '1'
@@ -46,12 +57,45 @@ RED = pygame.Color(100, 0, 0)
 DARK_GREY = pygame.Color(50, 50, 50)
 
 SETTINGS_FILE = '.gameconfig'
+
+def level_manifest(level, character):
+    """Return the assets.Manifest of the files level loads when played as character."""
+    return assets.manifest(level, character, BACKGROUNDS_DIRECTORY, DEFAULT_BACKGROUND, SOUNDS)
+
 class Game():
     GRAVITY = 2000
     FPS = 60
     LIFEBAR_LENGTH = 250
     LIFEBAR_WIDTH = 10
 
+    # In fixed step mode the simulation always advances SIM_RATE steps of
+    # 1/SIM_RATE seconds per second, however fast frames are drawn.  At most
+    # MAX_CATCH_UP_STEPS steps run per frame; after a long hitch the rest of
+    # the time is dropped instead of trying to catch up with it.  Sprites are
+    # swept against blockers, so a low SIM_RATE (--sim-rate) doesn't let them
+    # fall through floors.
+    SIM_RATE = 120
+    MAX_CATCH_UP_STEPS = 8
+    # frame rate limit in fixed step mode.  0 means no limit at all, which
+    # redraws as fast as the CPU can (only useful for benchmarking).
+    MAX_RENDER_FPS = FPS
+
+    # How a game ended; main() returns one of these.
+    QUIT = 'quit'
+    DIED = 'died'
+    BEATEN = 'beaten'
+    OUT_OF_FRAMES = 'out of frames'
+
+    # shows and hides the profiler overlay.
+    K_PROFILER = pygame.K_F3
+
+    # the assets.Preloader that preload() loaded the level with.
+    preloaded = None
+
+    # an assets.Prefetcher that preload() takes levels it has (started)
+    # loading from; main_menu sets one up.
+    prefetcher = None
+
 
     def change_state(self, key, event):
         """Change game's states based on player input"""
@@ -89,6 +133,31 @@ class Game():
                 elif event.key == player.K_SHOOT:
                     player.x_multiplier = player.NOT_RUNNING
 
+    @staticmethod
+    def level_file(settings):
+        """Return the path of the TMX file of the level in settings."""
+        level = settings['level']
+        if not level.startswith(MAPS_DIRECTORY):
+            level = os.path.join(MAPS_DIRECTORY, level)
+        return level
+
+    def preload(self, screen, settings, progress=None):
+        """
+        Load the files the level in settings needs (see assets.Manifest) on
+        worker threads before main() starts it, calling progress(done,
+        total) as they load.  main() then picks them up instead of loading
+        them itself.  If the prefetcher has been loading the level already,
+        this just waits for it to finish.
+        """
+        level = self.level_file(settings)
+        preloader = None
+        if self.prefetcher is not None:
+            preloader = self.prefetcher.take(level, settings['character'])
+        if preloader is None:
+            preloader = assets.Preloader(level_manifest(level, settings['character']), screen.get_size()).start()
+        self.preloaded = preloader.wait(progress).finish()
+        return self.preloaded
+
     def main(self, screen, settings):
         """
         Start the game by passing it the screen and settings dict.
@@ -96,26 +165,69 @@ class Game():
             level: the level to start.
             players: the number of players.
             character: the selected character.
-
+        and it can have:
+            fixed_step: if True, run the simulation in fixed steps (see
+                        SIM_RATE) and draw sprites interpolated between steps.
+            headless: if True, don't draw, play sounds, or wait between
+                      frames; each frame simulates 1/FPS seconds.
+            script: a headless.ScriptedInput to read input from instead of
+                    the keyboard.
+            frames: stop after this many frames.
+            profiler: a profiler.Profiler to time the game's frames with.
+            scroll_composite: if True, keep the static layers drawn on a
+                              surface that's scrolled with the camera.
+            dirty_rects: if True, only redraw the parts of the screen that
+                         changed while the camera isn't moving (this
+                         scrolls the static layers too).
+
+        Returns how the game ended: QUIT, DIED, BEATEN or OUT_OF_FRAMES.
         """
 
-        level = settings['level']
+        level = self.level_file(settings)
         players = settings['players']
         character = settings['character']
+        fixed_step = settings.get('fixed_step', False)
+        is_headless = settings.get('headless', False)
+        script = settings.get('script')
+        frames = settings.get('frames')
 
         self.level_beaten = False
-        if not level.startswith(MAPS_DIRECTORY):
-            level = os.path.join(MAPS_DIRECTORY, level)
-        self.tilemap = tmx.load(level, screen.get_size())
+        preloaded = self.preloaded
+        if preloaded is not None and preloaded.manifest.level != level:
+            preloaded = None
+        self.tilemap = tmx.load(level, screen.get_size(), cache=True)
         try:
             background_file = self.tilemap.properties['background']
 
         except KeyError:
             background_file = DEFAULT_BACKGROUND
 
-        background = images.load(os.path.join(BACKGROUNDS_DIRECTORY, background_file), convert=True, size=screen.get_size())
-
-        self.sprites = tmx.SpriteLayer()
+        enemy_cells = self.tilemap.layers['triggers'].find('enemy')
+        if not is_headless:
+            background_file = os.path.join(BACKGROUNDS_DIRECTORY, background_file)
+            decoded = None
+            if preloaded is not None and preloaded.manifest.background == background_file:
+                decoded = preloaded.background
+            background = images.load_background(background_file, screen.get_size(), decoded=decoded)
+
+            # pack the level's tiles and sprite images into a texture atlas
+            # before any sprites load their images.
+            image_keys = sprites.Player.image_keys(character)
+            for enemy_type in set(enemy['enemy'] for enemy in enemy_cells):
+                image_keys += sprites.Enemy.image_keys(enemy_type)
+            atlas.Atlas.forlevel(self.tilemap, image_keys)
+
+        # the sprites' animation clips are made again for each level, from
+        # the images that are loaded now (which may be in the new atlas).
+        pyganim.clearClips()
+
+        # the sprites are animated by game time, so they pause, slow down and
+        # speed up with the game.
+        self.animation_clock = pyganim.AnimationClock()
+        pyganim.default_clock = self.animation_clock
+
+        self.sprites = tmx.SpriteLayer('sprites')
+        self.bullet_pool = sprites.BulletPool(self.sprites)
         start_cell = self.tilemap.layers['triggers'].find('player')[0]
 
         self.players = []
@@ -127,41 +239,83 @@ class Game():
         self.tilemap.layers.append(self.sprites)
 
         # sound effects
-        self.jump = pygame.mixer.Sound('sounds/jump.wav')
-        self.shoot = pygame.mixer.Sound('sounds/shoot.wav')
-        self.explosion = pygame.mixer.Sound('sounds/explosion.wav')
+        if is_headless:
+            self.jump = self.shoot = self.explosion = headless.SilentSound()
+        else:
+            sounds = preloaded.sounds if preloaded is not None else {}
+            for name, wav in SOUNDS.items():
+                sound = sounds.get(name)
+                setattr(self, name, sound if sound is not None else pygame.mixer.Sound(wav))
 
-        self.enemies = tmx.SpriteLayer()
-        for enemy in self.tilemap.layers['triggers'].find('enemy'):
+        self.enemies = sprites.EnemyLayer('enemies')
+        for enemy in enemy_cells:
 
             sprites.Enemy((enemy.px, enemy.py), enemy['enemy'], self.enemies)
 
         self.tilemap.layers.append(self.enemies)
+        self.blockers = collision.BlockerGrid(self.tilemap.layers['triggers'], self.tilemap.tile_width)
+        self.set_profiler(settings.get('profiler', profiler.NULL_PROFILER))
+        if is_headless:
+            renderer = None
+        elif settings.get('dirty_rects', False):
+            renderer = render.DirtyRectRenderer(screen, background)
+        elif settings.get('scroll_composite', False):
+            renderer = render.ScrollRenderer(screen, background)
+        else:
+            renderer = render.Renderer(screen, background)
 
         clock = pygame.time.Clock()
+        accumulator = 0
+        self.frame = 0
+        self.profiler.start_frame()
         while True:
-            dt = clock.tick(self.FPS) / 1000
-            key = pygame.key.get_pressed()
-            events = pygame.event.get()
+            if frames is not None and self.frame >= frames:
+                return self.OUT_OF_FRAMES
+            if is_headless:
+                dt = 1 / self.FPS
+            elif fixed_step:
+                dt = clock.tick(self.MAX_RENDER_FPS) / 1000
+            else:
+                dt = clock.tick(self.FPS) / 1000
+            with self.profiler.stage('events'):
+                if script is None:
+                    key = pygame.key.get_pressed()
+                    events = pygame.event.get()
+                else:
+                    key, events = script.poll(self, self.frame)
+                self.frame += 1
 
-            for event in events:
-                if event.type == pygame.QUIT:
-                    return
+                for event in events:
+                    if event.type == pygame.QUIT:
+                        return self.QUIT
 
-                elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                        return
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                            return self.QUIT
 
+                    elif event.type == pygame.KEYDOWN and event.key == self.K_PROFILER:
+                        self.toggle_profiler()
+
+                    else:
+                        self.change_state(key, event)
+
+            with self.profiler.stage('update'):
+                if fixed_step:
+                    accumulator = self.run_fixed_steps(accumulator + dt)
                 else:
-                    self.change_state(key, event)
-
-            screen.blit(background, (0,0))
-            self.tilemap.update(dt, self)
-            self.tilemap.draw(screen)
-            for offset, player in enumerate(self.players):
-                self.draw_lifebar(screen, player.health, player.MAX_HEALTH, offset)
-                if player.is_dead:
-                    return
-            pygame.display.flip()
+                    self.step(dt)
+            if any(player.is_dead for player in self.players):
+                return self.DIED
+
+            if not is_headless:
+                with self.profiler.stage('draw'):
+                    renderer.draw(self.tilemap)
+                with self.profiler.stage('lifebars'):
+                    for offset, player in enumerate(self.players):
+                        renderer.mark(self.draw_lifebar(screen, player.health, player.MAX_HEALTH, offset))
+                renderer.mark(self.profiler.draw(screen))
+                with self.profiler.stage('flip'):
+                    renderer.present()
+            self.profiler.end_frame()
 
             # this is how you beat the level.
             try:
@@ -174,8 +328,52 @@ class Game():
                 pass
             # level finished.  better do something better.
             if self.level_beaten:
-                self.beat_level(screen, clock)
-                return
+                if not is_headless:
+                    self.beat_level(screen, clock)
+                return self.BEATEN
+
+    def set_profiler(self, profiler):
+        """Time frames (and the tilemap's layers) with profiler."""
+        self.profiler = profiler
+        self.tilemap.profiler = profiler if profiler.enabled else None
+
+    def toggle_profiler(self):
+        """Show or hide the profiler overlay, starting to profile if we weren't."""
+        if not self.profiler.enabled:
+            self.set_profiler(profiler.Profiler())
+        self.profiler.overlay = not self.profiler.overlay
+
+    def step(self, dt):
+        """Advance the animations and the simulation by dt seconds."""
+        self.animation_clock.tick(dt)
+        self.tilemap.update(dt, self)
+
+    def run_fixed_steps(self, accumulator):
+        """
+        Advance the simulation in steps of 1/SIM_RATE seconds until less than
+        a step of the `accumulator` seconds is left, and return what's left.
+        The sprite layers are then set up to draw their sprites that far
+        between the last two steps.
+        """
+        step = 1 / self.SIM_RATE
+        steps = 0
+        while accumulator >= step:
+            if steps == self.MAX_CATCH_UP_STEPS:
+                # too far behind; don't let one slow frame snowball.
+                accumulator %= step
+                break
+            self.sprites.remember_positions()
+            self.enemies.remember_positions()
+            self.step(step)
+            accumulator -= step
+            steps += 1
+
+        alpha = accumulator / step
+        self.sprites.interpolation = alpha
+        self.enemies.interpolation = alpha
+        # the camera has to follow the interpolated player, too.
+        self.tilemap.set_focus(*self.sprites.interpolated_position(self.players[-1]))
+        return accumulator
 
     def beat_level(self, screen, clock):
         font = pygame.font.Font(None, 150)
@@ -192,8 +390,9 @@ class Game():
             pygame.display.flip()
 
     def draw_lifebar(self, screen, health, max_health, offset):
+        """Draw a player's lifebar, and return the rect it covers."""
         # outline for lifebar
-        pygame.draw.rect(screen, DARK_GREY, (10,10 + offset*25, self.LIFEBAR_LENGTH, 20))
+        outline = pygame.draw.rect(screen, DARK_GREY, (10,10 + offset*25, self.LIFEBAR_LENGTH, 20))
 
         ratio = health / max_health
         if ratio < 0.15:
@@ -205,6 +404,7 @@ class Game():
 
         length = (self.LIFEBAR_LENGTH - 3) * health/max_health
         pygame.draw.rect(screen, color, (12,12 + offset*25, (length), 16))
+        return outline
 
 
 def main_menu(screen, Game, default_settings,
@@ -234,11 +434,83 @@ def main_menu(screen, Game, default_settings,
     [character_select_menu.change_settings(i, 'character', character_items[i]) for i in range(len(characters))]
     character_select_menu.add_back_action(-1)
 
+    # load the highlighted level, as the highlighted character, while the
+    # player makes up their mind.
+    Game.prefetcher = assets.Prefetcher(screen.get_size(), level_manifest)
+    main_menu.add_highlight_action(
+        lambda settings: Game.prefetcher.prefetch(Game.level_file(settings), settings['character']))
+
     try:
-        main_menu.mainloop()
+        # whatever happens, stop the prefetcher's thread (before pygame.quit)
+        # so it doesn't hold up the interpreter exiting.
+        try:
+            main_menu.mainloop()
+        finally:
+            Game.prefetcher.close()
     except menu.Exit:
         pygame.quit()
 
+def run_headless(level, script=(), frames=3600, character=DEFAULT_CHARACTER,
+                 players=1, fixed_step=False, size=SCREEN_SIZE, profiler=None):
+    """
+    Play a level with no display, sound or keyboard, as fast as possible.
+
+    Args
+        level: the level to play.
+        script: a headless.ScriptedInput, or a list of (frame, action, key)
+                entries to make one from.
+        frames: the most frames to play.
+        character, players, fixed_step, profiler: the same as the Game.main
+                                                  settings.
+        size: the (pretend) screen size, which decides what's on screen.
+
+    Returns a dict with the level, how the game ended, the number of frames
+    played, and each player's health and position.
+    """
+    screen = headless.init(size)
+    if not isinstance(script, headless.ScriptedInput):
+        script = headless.ScriptedInput(script)
+    settings = {'level': level,
+                'players': players,
+                'character': character,
+                'fixed_step': fixed_step,
+                'headless': True,
+                'script': script,
+                'frames': frames}
+    if profiler is not None:
+        settings['profiler'] = profiler
+    game = Game()
+    outcome = game.main(screen, settings)
+    return {'level': level,
+            'outcome': outcome,
+            'frames': game.frame,
+            'players': [{'health': player.health, 'position': tuple(player.rect.topleft)}
+                        for player in game.players]}
+
+
+def _run_headless_job(kwargs):
+    # Internal helper for run_many: multiprocessing can only map one argument.
+    return run_headless(**kwargs)
+
+
+def run_many(jobs, processes=None):
+    """
+    Run headless games in parallel worker processes.
+
+    Args
+        jobs: a list of dicts of keyword arguments for run_headless.
+        processes: the number of worker processes; defaults to the number of CPUs.
+
+    Returns the run_headless results, in the same order as jobs.
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_run_headless_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def get_settings():
     """
     Read in settings from .config file; otherwise, use constants
@@ -279,22 +551,99 @@ def get_clargs():
                         action='store_true',
                         default=False)
 
+    parser.add_argument('-f', '--fixed-step',
+                        help="Run the simulation at a fixed rate, independent of the frame rate.",
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--sim-rate',
+                        help="Simulation steps per second with --fixed-step (default %(default)s).",
+                        type=int,
+                        default=Game.SIM_RATE)
+
+    parser.add_argument('--max-render-fps',
+                        help="Most frames drawn per second with --fixed-step; "
+                             "0 for no limit (default %(default)s).",
+                        type=int,
+                        default=Game.MAX_RENDER_FPS)
+
+    parser.add_argument('--dirty-rects',
+                        help="Only redraw the changed parts of the screen while the camera is still.",
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--scroll-composite',
+                        help="Scroll the drawn map with the camera instead of redrawing it every frame.",
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--image-budget',
+                        help="How many MiB of images to keep cached (default %(default)s).",
+                        type=int,
+                        default=images.DEFAULT_BUDGET // (1024 * 1024))
+
+    parser.add_argument('--headless',
+                        help="Play the configured level without a display or sound, "
+                             "print how it ended, and exit.",
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--frames',
+                        help="How many frames to play with --headless.",
+                        type=int,
+                        default=3600)
+
+    parser.add_argument('--script',
+                        help="A JSON file with a list of [frame, 'down' or 'up', key name] "
+                             "entries to use as input with --headless.")
+
+    parser.add_argument('--profile',
+                        help="Time every frame, and save the statistics to this file on exit. "
+                             "F3 shows them in game.",
+                        metavar='FILE')
 
     return parser.parse_args()
 
 if __name__ == '__main__':
-    pygame.init()
     args = get_clargs()
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
+    frame_profiler = profiler.Profiler() if args.profile else None
+    images.load.budget = args.image_budget * 1024 * 1024
+    Game.SIM_RATE = args.sim_rate
+    Game.MAX_RENDER_FPS = args.max_render_fps
+
+    if args.headless:
+        settings = get_settings()
+        script = []
+        if args.script:
+            with open(args.script) as f:
+                script = json.load(f)
+        print(run_headless(settings['level'], script, args.frames,
+                           settings['character'], settings['players'], args.fixed_step,
+                           profiler=frame_profiler))
+        if frame_profiler:
+            frame_profiler.dump(args.profile)
+        raise SystemExit
+
+    pygame.init()
+
     if args.small:
         screen = pygame.display.set_mode(SCREEN_SIZE)
     else:
         screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
 
     settings = get_settings()
+    settings['fixed_step'] = args.fixed_step
+    settings['dirty_rects'] = args.dirty_rects
+    settings['scroll_composite'] = args.scroll_composite
+    if frame_profiler:
+        settings['profiler'] = frame_profiler
 
     main_menu(screen, Game, settings)
 
+    if frame_profiler:
+        frame_profiler.dump(args.profile)
+
@@ -0,0 +1,256 @@
+"""
+Loading a level's files before the level starts.
+
+A Manifest lists the files a level is going to load: its tileset images and
+background (read from the TMX file), the sprite images of the players'
+character and of every enemy type in its triggers, and the sound effects.
+
+A Preloader reads and decodes them on a pool of threads, while the main
+thread is free to draw a progress bar.  Converting surfaces to the
+display's format has to be done on the main thread, so the workers only
+decode; finish() then hands the decoded images to the image cache, where
+the tilesets, the sprites and the background pick them up as they load.
+Anything the manifest missed is just loaded as usual when it's needed.
+
+A Prefetcher starts Preloaders in the background for levels the player
+might be about to start (the one highlighted in the menu, say), so that
+by the time they pick one it may already be loaded.
+"""
+
+from __future__ import division
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os import path
+from xml.etree import ElementTree
+
+import pygame
+
+from . import images
+from . import sprites
+
+# how many threads load the files.
+DEFAULT_WORKERS = 4
+
+# how many levels a Prefetcher keeps loaded (or loading) at once.
+PREFETCH_CAPACITY = 2
+
+# tilesets: the tileset image files.
+# background: the background image file, or None.
+# images: the sprite image files.
+# sounds: a dict of sound name -> wav file.
+Manifest = namedtuple('Manifest', 'level tilesets background images sounds')
+
+
+def read_level(level):
+    """
+    Return (tileset image files, map properties, enemy types) from the TMX
+    file level, without loading it.
+    """
+    with open(level) as f:
+        root = ElementTree.fromstring(f.read())
+    tilesets = []
+    for tag in root.findall('tileset'):
+        if 'source' in tag.attrib:
+            # tmx.Tileset.fromxml opens these relative to the working directory too.
+            with open(tag.attrib['source']) as f:
+                tag = ElementTree.fromstring(f.read())
+        for image in tag.findall('image'):
+            tilesets.append(path.normpath(path.join(path.dirname(level), image.attrib['source'])))
+    properties = dict((prop.attrib['name'], prop.attrib['value'])
+                      for prop in root.findall('properties/property'))
+    enemies = set(prop.attrib['value']
+                  for prop in root.findall("objectgroup[@name='triggers']/object/properties/property")
+                  if prop.attrib['name'] == 'enemy')
+    return tilesets, properties, enemies
+
+
+def manifest(level, character, backgrounds_directory, default_background, sounds):
+    """
+    Return the Manifest of the files the level will load.
+
+    Args
+        level: path to the TMX file.
+        character: the players' character.
+        backgrounds_directory: where the map's background property is looked up.
+        default_background: the background of maps without one.
+        sounds: a dict of sound name -> wav file.
+    """
+    tilesets, properties, enemies = read_level(level)
+    background = path.join(backgrounds_directory, properties.get('background', default_background))
+    keys = sprites.Player.image_keys(character)
+    for enemy in sorted(enemies):
+        keys += sprites.Enemy.image_keys(enemy)
+    files = sorted(set(image for image, kwargs in keys))
+    return Manifest(level, tilesets, background, files, dict(sounds))
+
+
+class Preloader(object):
+    """
+    Loads the files of a Manifest on a pool of worker threads.
+
+    Args
+        manifest: the Manifest.
+        size: the screen size; the background is scaled to it.
+        workers: how many threads to load with.
+        sounds: whether to load the sounds (there has to be a mixer).
+
+    start() sets the workers going, wait() blocks until they're done, and
+    finish() hands what they loaded to the image cache; cancel() gives up
+    on whatever hasn't started loading yet.  Afterwards
+    `background` is the decoded background to pass to
+    images.load_background, and `sounds` a dict of the pygame Sounds.
+    """
+    def __init__(self, manifest, size, workers=DEFAULT_WORKERS, sounds=True):
+        self.manifest = manifest
+        self.size = tuple(size)
+        self.workers = workers
+        self.load_sounds = sounds
+        self.futures = {}
+        self.background = None
+        self.sounds = {}
+
+    def start(self, pool=None):
+        """
+        Start loading everything, on pool (a concurrent.futures Executor)
+        if it's given and otherwise on threads of our own; return self.
+        """
+        manifest = self.manifest
+        own_pool = pool is None
+        if own_pool:
+            pool = ThreadPoolExecutor(self.workers)
+        for image in manifest.tilesets + manifest.images:
+            self.futures[pool.submit(pygame.image.load, image)] = ('image', image)
+        if manifest.background is not None and path.isfile(manifest.background):
+            future = pool.submit(images.decode_background, manifest.background, self.size)
+            self.futures[future] = ('background', manifest.background)
+        if self.load_sounds:
+            for name, wav in manifest.sounds.items():
+                self.futures[pool.submit(pygame.mixer.Sound, wav)] = ('sound', name)
+        if own_pool:
+            # the workers finish what they were given, then go away.
+            pool.shutdown(wait=False)
+        return self
+
+    def cancel(self):
+        """Stop loading the files that haven't been started on yet."""
+        for future in self.futures:
+            future.cancel()
+
+    @property
+    def total(self):
+        """How many files there are to load."""
+        return len(self.futures)
+
+    def wait(self, progress=None):
+        """
+        Wait for everything to load, calling progress(done, total) before
+        and every time more files have loaded.
+        """
+        pending = set(self.futures)
+        while pending:
+            if progress is not None:
+                progress(self.total - len(pending), self.total)
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        if progress is not None:
+            progress(self.total, self.total)
+        return self
+
+    def finish(self):
+        """
+        Put the decoded images into the image cache, and keep the background
+        and sounds.  A file that failed to load (or was cancelled) is left
+        to be loaded (and fail) as usual.
+        """
+        for future, (kind, name) in self.futures.items():
+            if future.cancelled() or future.exception() is not None:
+                continue
+            if kind == 'image':
+                if not images.load.contains(name):
+                    images.load.replace(future.result(), name)
+            elif kind == 'background':
+                self.background = future.result()
+            else:
+                self.sounds[name] = future.result()
+        return self
+
+    def run(self, progress=None):
+        """Load everything, showing progress with progress(done, total); return self."""
+        return self.start().wait(progress).finish()
+
+
+class Prefetcher(object):
+    """
+    Loads the levels the player might start next, on one background thread.
+
+    Args
+        size: the screen size.
+        manifest: a function of (level, character) that returns the
+                  Manifest for that level, played as that character.  It's
+                  called on the background thread.
+        capacity: the most levels to keep loaded or loading.  Asking for
+                  another drops the one asked for longest ago, and cancels
+                  whatever it had left to load.
+        sounds: whether to load the sounds.
+
+    prefetch(level, character) starts loading a level (unless it already
+    is), take(level, character) hands over its Preloader, and cancel()
+    drops everything.  close() cancels everything and waits for the
+    background thread to stop; call it before pygame.quit(), so the
+    thread isn't still decoding a file when pygame shuts down.
+    """
+    def __init__(self, size, manifest, capacity=PREFETCH_CAPACITY, sounds=True):
+        self.size = tuple(size)
+        self.manifest = manifest
+        self.capacity = capacity
+        self.sounds = sounds
+        self.pool = ThreadPoolExecutor(1)
+        # (level, character) -> future of the level's started Preloader,
+        # least recently asked for first.
+        self.levels = OrderedDict()
+
+    def _start(self, level, character):
+        preloader = Preloader(self.manifest(level, character), self.size, sounds=self.sounds)
+        return preloader.start(self.pool)
+
+    def prefetch(self, level, character):
+        """Start loading level, played as character, in the background."""
+        key = (level, character)
+        if key in self.levels:
+            self.levels.move_to_end(key)
+            return
+        self.levels[key] = self.pool.submit(self._start, level, character)
+        while len(self.levels) > self.capacity:
+            self._drop(self.levels.popitem(last=False)[1])
+
+    def take(self, level, character):
+        """
+        Return the Preloader (maybe still loading) for level played as
+        character and forget about it, or None if it wasn't prefetched.
+        """
+        future = self.levels.pop((level, character), None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception:
+            # it'll just be loaded the usual way.
+            return None
+
+    def cancel(self):
+        """Drop every level, cancelling what hasn't been loaded yet."""
+        while self.levels:
+            self._drop(self.levels.popitem(last=False)[1])
+
+    def close(self):
+        """Cancel everything, and wait for the background thread to finish."""
+        self.cancel()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _drop(future):
+        def cancel_preloader(future):
+            if future.exception() is None:
+                future.result().cancel()
+        if not future.cancel():
+            # it's already making the Preloader; cancel that once it has.
+            future.add_done_callback(cancel_preloader)
@@ -0,0 +1,245 @@
+"""
+Texture atlases: lots of little surfaces packed onto a few big ones.
+
+Blitting every tile and sprite frame of a level from a handful of large,
+display-format surfaces keeps their pixels together in memory and avoids the
+per-surface overhead (and per-blit format conversion) of hundreds of small
+surfaces.  The packed atlas for a level is saved to disk, so it only has to
+be built the first time the level is played.
+"""
+
+from __future__ import division
+import hashlib
+import marshal
+import os
+
+import pygame
+
+from . import images
+from . import tmx
+
+# width and height of an atlas page in pixels.
+PAGE_SIZE = 1024
+
+CACHE_DIRECTORY = os.path.join('cache', 'atlas')
+CACHE_VERSION = 1
+
+# how many bytes of saved atlases forlevel keeps on disk.
+CACHE_LIMIT = 32 * 1024 * 1024
+
+
+def shelf_pack(sizes, page_size=PAGE_SIZE):
+    """
+    Pack rectangles onto pages, shelf by shelf.
+
+    Args
+        sizes: a list of (key, (width, height)) pairs.
+        page_size: width and height of each page.
+
+    Returns (placements, page_sizes): a dict mapping each key to
+    (page index, x, y), and the (width, height) each page needs.  Anything
+    bigger than a page gets a page of its own.
+    """
+    # tallest first, so shelves don't waste much height.
+    order = sorted(range(len(sizes)),
+                   key=lambda i: (-sizes[i][1][1], -sizes[i][1][0], i))
+    placements = {}
+    # each page is [used width, used height, shelves]; a shelf is [y, height, x]
+    pages = []
+    for i in order:
+        key, (w, h) = sizes[i]
+        if w > page_size or h > page_size:
+            placements[key] = (len(pages), 0, 0)
+            pages.append([w, h, []])
+            continue
+
+        for page_index, page in enumerate(pages):
+            spot = _place(page, w, h, page_size)
+            if spot is not None:
+                break
+        else:
+            page_index, page = len(pages), [0, 0, []]
+            pages.append(page)
+            spot = _place(page, w, h, page_size)
+        placements[key] = (page_index,) + spot
+
+    return placements, [(max(1, p[0]), max(1, p[1])) for p in pages]
+
+
+def _place(page, w, h, page_size):
+    # Internal helper for shelf_pack: put a w x h rect on page, or return
+    # None if it doesn't fit.
+    used_w, used_h, shelves = page
+    if used_w > page_size:
+        # a page holding one oversized rect.
+        return None
+    for shelf in shelves:
+        y, height, x = shelf
+        if h <= height and x + w <= page_size:
+            shelf[2] += w
+            page[0] = max(page[0], x + w)
+            return x, y
+    if used_h + h <= page_size:
+        shelves.append([used_h, h, w])
+        page[0] = max(page[0], w)
+        page[1] = used_h + h
+        return 0, used_h
+    return None
+
+
+class Atlas(object):
+    """
+    A set of big surfaces ("pages") with smaller surfaces packed onto them.
+
+    Attributes
+        pages: the page Surfaces.
+        rects: dict mapping each key to (page index, pygame.Rect).
+
+    `get(key)` returns a subsurface of the page, which blits exactly like the
+    surface that was packed but shares the page's pixels.
+    """
+    def __init__(self, pages, rects):
+        self.pages = pages
+        self.rects = rects
+        self._subsurfaces = {}
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def get(self, key):
+        try:
+            return self._subsurfaces[key]
+        except KeyError:
+            page, rect = self.rects[key]
+            surface = self.pages[page].subsurface(rect)
+            self._subsurfaces[key] = surface
+            return surface
+
+    @classmethod
+    def pack(cls, surfaces, page_size=PAGE_SIZE):
+        """Return an Atlas holding the surfaces in the dict `surfaces`."""
+        sizes = [(key, surfaces[key].get_size()) for key in surfaces]
+        placements, page_sizes = shelf_pack(sizes, page_size)
+        pages = []
+        for size in page_sizes:
+            page = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+            # blitting onto fully transparent pixels copies the source pixels
+            # (colorkeyed ones stay transparent).
+            page.fill((0, 0, 0, 0))
+            pages.append(page)
+
+        rects = {}
+        for key, size in sizes:
+            page, x, y = placements[key]
+            rects[key] = (page, pygame.Rect((x, y), size))
+            pages[page].blit(surfaces[key], (x, y))
+        return cls(pages, rects)
+
+    def save(self, filename):
+        """
+        Write the atlas (pages as raw RGBA) to filename.  Failing to write
+        it is not an error; the atlas just gets packed again next time.
+        """
+        data = {
+            'version': CACHE_VERSION,
+            'rects': dict((key, (page, tuple(rect)))
+                          for key, (page, rect) in self.rects.items()),
+            'pages': [(page.get_size(), pygame.image.tostring(page, 'RGBA'))
+                      for page in self.pages],
+        }
+        tmp = filename + '.tmp'
+        try:
+            directory = os.path.dirname(filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, 'wb') as f:
+                marshal.dump(data, f)
+            os.replace(tmp, filename)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except (IOError, OSError):
+                pass
+
+    @classmethod
+    def load(cls, filename):
+        """Read an atlas written by save().  Return None if it can't be read."""
+        try:
+            with open(filename, 'rb') as f:
+                data = marshal.load(f)
+            if data['version'] != CACHE_VERSION:
+                return None
+            pages = [pygame.image.fromstring(pixels, size, 'RGBA').convert_alpha()
+                     for size, pixels in data['pages']]
+            rects = dict((key, (page, pygame.Rect(rect)))
+                         for key, (page, rect) in data['rects'].items())
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+            return None
+        return cls(pages, rects)
+
+    @classmethod
+    def forlevel(cls, tilemap, image_keys, cache_directory=CACHE_DIRECTORY,
+                 cache_limit=CACHE_LIMIT):
+        """
+        Pack the tiles of a level and the sprite images it uses into an
+        atlas, and make the tiles and the image cache use it.
+
+        Args
+            tilemap: the level's TileMap.  Every tile used by its layers
+                     (flipped variants included) is packed.
+            image_keys: (image_path, kwargs) pairs of the `images.load` calls
+                        the level's sprites will make.
+            cache_directory: where packed atlases are saved.  An atlas is
+                             reused as long as the source image files
+                             haven't changed.
+            cache_limit: how many bytes of atlases to keep in
+                         cache_directory.  Past that, the ones used longest
+                         ago are deleted.
+
+        Whatever the image cache had from other atlases is dropped from it.
+        """
+        gids = set()
+        for layer in tilemap.layers:
+            if isinstance(layer, tmx.Layer):
+                gids.update(gid for gid in set(layer.cells.gids) if gid)
+            elif isinstance(layer, tmx.ObjectLayer):
+                gids.update(obj.gid for obj in layer.objects if obj.tile)
+        tile_keys = [('tile', gid) for gid in sorted(gids)]
+        image_keys = sorted(set((path, tuple(sorted(kwargs.items())))
+                                for path, kwargs in image_keys))
+
+        sources = set(path for path, kwargs in image_keys)
+        for gid in gids:
+            sources.update(tilemap.tilesets[gid].tileset.images)
+        signature = hashlib.sha1(repr((tile_keys, image_keys)).encode())
+        for source in sorted(sources):
+            stat = os.stat(source)
+            signature.update(repr((source, stat.st_size, stat.st_mtime_ns)).encode())
+        filename = os.path.join(cache_directory, signature.hexdigest() + '.atlas')
+
+        atlas = cls.load(filename)
+        if atlas is not None:
+            try:
+                # images.prune_cache goes by access time.
+                os.utime(filename)
+            except (IOError, OSError):
+                pass
+        else:
+            surfaces = {}
+            for key in tile_keys:
+                surfaces[key] = tilemap.tilesets[key[1]].surface
+            for path, kwargs in image_keys:
+                surfaces[images.key(path, **dict(kwargs))] = images.load(path, **dict(kwargs))
+            atlas = cls.pack(surfaces)
+            atlas.save(filename)
+            images.prune_cache(cache_directory, cache_limit, keep=[filename])
+
+        for key in tile_keys:
+            tilemap.tilesets[key[1]].surface = atlas.get(key)
+        # the previous level's atlas pages stay alive as long as the image
+        # cache holds subsurfaces of them.
+        images.load.drop_subsurfaces(keep=atlas.pages)
+        for path, kwargs in image_keys:
+            images.load.replace(atlas.get(images.key(path, **dict(kwargs))),
+                                path, **dict(kwargs))
+        return atlas
@@ -0,0 +1,166 @@
+"""
+Collision structures compiled from a map's trigger objects.
+
+The triggers layer marks solid ground, walls and ceilings with objects that
+have a `blockers` property: a string of the sides that are solid, 'l', 'r',
+'t' and 'b' (e.g. 'tlr').  Those objects don't move, so rather than asking
+the layer for them and reading the property string for every sprite every
+frame, a BlockerGrid compiles them once into Blockers with the sides
+decoded into a bitmask, filed on a grid of tile-sized buckets.
+
+SweepAndPrune keeps sprites, which do move, sorted along x as a broad
+phase for collisions between sprites (bullets against enemies, say).
+"""
+
+from __future__ import division
+from collections import namedtuple
+import bisect
+
+# the side bits of Blocker.sides.
+LEFT = 1
+RIGHT = 2
+TOP = 4
+BOTTOM = 8
+
+SIDES = {'l': LEFT, 'r': RIGHT, 't': TOP, 'b': BOTTOM}
+
+# Size (in pixels) of the grid's square buckets; the maps' tile size.
+DEFAULT_CELL_SIZE = 32
+
+# how many queries a SweepAndPrune answers by checking every sprite before
+# it sorts them.
+BROAD_PHASE_MIN_QUERIES = 4
+
+# order is the blocker's position in the layer, so sorting blockers puts
+# them in the order the layer's collide() returns them.
+Blocker = namedtuple('Blocker', 'order left top right bottom sides cell')
+
+
+def decode_sides(blockers):
+    """Return the side bits for a blockers property string like 'tlr'."""
+    sides = 0
+    for side, bit in SIDES.items():
+        if side in blockers:
+            sides |= bit
+    return sides
+
+
+class BlockerGrid(object):
+    """
+    The blocker objects of an ObjectLayer, filed by the grid buckets they
+    touch.
+
+    Args
+        layer: the ObjectLayer with the blockers (the map's triggers).
+        cell_size: the width and height of a bucket in pixels.
+
+    collide() finds the same blockers, in the same order, as
+    layer.collide(rect, 'blockers') would.  The grid is compiled again
+    whenever the layer's version or number of objects changes.  Its queries
+    are counted in the layer's queries, so the profiler still sees them.
+    """
+    def __init__(self, layer, cell_size=DEFAULT_CELL_SIZE):
+        self.layer = layer
+        self.cell_size = cell_size
+        self.version = None
+        self.blockers = []
+        self.buckets = {}
+        self.refresh()
+
+    def refresh(self):
+        """Compile the grid again if the layer has changed; return self."""
+        layer = self.layer
+        if self.version == (layer.version, len(layer.objects)):
+            return self
+        # find() indexes the layer again first if its objects were changed.
+        cells = layer.find('blockers')
+        size = self.cell_size
+        self.blockers = []
+        self.buckets = {}
+        for order, cell in enumerate(cells):
+            if 'blockers' in cell:
+                sides = decode_sides(cell['blockers'])
+            else:
+                sides = decode_sides(layer.properties['blockers'])
+            blocker = Blocker(order, cell.left, cell.top, cell.right, cell.bottom, sides, cell)
+            self.blockers.append(blocker)
+            for i in range(blocker.left // size, blocker.right // size + 1):
+                for j in range(blocker.top // size, blocker.bottom // size + 1):
+                    self.buckets.setdefault((i, j), []).append(blocker)
+        self.version = (layer.version, len(layer.objects))
+        return self
+
+    def collide(self, rect):
+        """Return the Blockers that rect touches, in layer order."""
+        self.refresh()
+        self.layer.queries += 1
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        size = self.cell_size
+        i1, i2 = left // size, right // size
+        j1, j2 = top // size, bottom // size
+        buckets = self.buckets
+        if i1 == i2 and j1 == j2:
+            candidates = buckets.get((i1, j1), ())
+        else:
+            found = {}
+            for i in range(i1, i2 + 1):
+                for j in range(j1, j2 + 1):
+                    for blocker in buckets.get((i, j), ()):
+                        found[blocker.order] = blocker
+            candidates = [found[order] for order in sorted(found)]
+        return [b for b in candidates
+                if right >= b.left and bottom >= b.top and left <= b.right and top <= b.bottom]
+
+
+class SweepAndPrune(object):
+    """
+    A broad phase for collisions with the sprites of a group: the sprites
+    sorted by the left edges of their rects, so a query only has to look at
+    the ones whose left edges are within reach of the rect's.
+
+    Args
+        group: the sprite group (e.g. the enemies).
+        min_queries: how many queries have to be made since the sprites
+                     last moved before they're sorted.  Sorting costs about
+                     as much as a few linear scans, so until then collide()
+                     just checks every sprite.
+
+    collide(rect) returns the same sprites, in the same order, as
+    pygame.sprite.spritecollide would for a sprite with that rect.  Call
+    invalidate() whenever the sprites move or sprites are added; sprites
+    that are killed are skipped without sorting them again.
+    """
+    def __init__(self, group, min_queries=BROAD_PHASE_MIN_QUERIES):
+        self.group = group
+        self.min_queries = min_queries
+        self.entries = None
+        self.queries = 0
+
+    def invalidate(self):
+        """Forget where the sprites were."""
+        self.entries = None
+        self.queries = 0
+
+    def _sort(self):
+        sprites = self.group.sprites()
+        lefts = [sprite.rect.left for sprite in sprites]
+        by_left = sorted(range(len(sprites)), key=lefts.__getitem__)
+        self.lefts = [lefts[i] for i in by_left]
+        # (position in the group, sprite), so sorting entries puts them in group order.
+        self.entries = [(i, sprites[i]) for i in by_left]
+        # how far left of a rect a sprite can start and still reach it.
+        self.reach = max([sprite.rect.width for sprite in sprites] or [0])
+
+    def collide(self, rect):
+        """Return the group's sprites that collide with rect, in group order."""
+        self.queries += 1
+        if self.entries is None:
+            if self.queries <= self.min_queries:
+                return [sprite for sprite in self.group if rect.colliderect(sprite.rect)]
+            self._sort()
+
+        first = bisect.bisect_right(self.lefts, rect.left - self.reach)
+        last = bisect.bisect_left(self.lefts, rect.right, first)
+        has = self.group.has_internal
+        return [sprite for _, sprite in sorted(self.entries[first:last])
+                if has(sprite) and rect.colliderect(sprite.rect)]
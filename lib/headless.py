@@ -0,0 +1,86 @@
+"""
+Helpers for running the game without a display, sound card or keyboard.
+
+`Game.main` uses these when it's given the `headless` or `script` settings,
+so levels can be soak-tested, played through by bots, or profiled with
+nothing but the simulation running.
+"""
+
+from __future__ import division
+from collections import defaultdict
+import os
+
+import pygame
+
+
+def init(size):
+    """
+    Initialize pygame on SDL's dummy video and audio drivers and return a
+    display surface of the given size.  Images can still be loaded and
+    converted; nothing is ever shown or played.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    pygame.init()
+    screen = pygame.display.get_surface()
+    if screen is None or screen.get_size() != tuple(size):
+        screen = pygame.display.set_mode(size)
+    return screen
+
+
+class SilentSound(object):
+    """Stands in for a pygame.mixer.Sound, without loading or playing anything."""
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+
+class KeyState(set):
+    """
+    The set of keys currently held down.  Can be indexed with a key like
+    the list returned by `pygame.key.get_pressed()`.
+    """
+    def __getitem__(self, key):
+        return key in self
+
+
+class ScriptedInput(object):
+    """
+    Keyboard input read from a script instead of from pygame.
+
+    Args
+        script: a list of (frame, action, key) entries.  action is 'down' or
+                'up', and key is a pygame key constant or a key name like
+                'right' or 'space'.  The key is pressed or released at the
+                start of the given frame (counting from 0).
+
+    Subclasses (bots, say) can override `poll` to decide what to press by
+    looking at the game.
+    """
+    ACTIONS = {'down': pygame.KEYDOWN, 'up': pygame.KEYUP}
+
+    def __init__(self, script=()):
+        self.pressed = KeyState()
+        self.script = defaultdict(list)
+        for frame, action, key in script:
+            if not isinstance(key, int):
+                key = pygame.key.key_code(key)
+            self.script[frame].append((self.ACTIONS[action], key))
+
+    def event(self, type, key):
+        """Return a key event, keeping track of which keys are held down."""
+        if type == pygame.KEYDOWN:
+            self.pressed.add(key)
+        else:
+            self.pressed.discard(key)
+        return pygame.event.Event(type, key=key)
+
+    def poll(self, game, frame):
+        """
+        Return (pressed, events) for the given frame, the same as
+        `pygame.key.get_pressed()` and `pygame.event.get()` would.
+        """
+        events = [self.event(type, key) for type, key in self.script.get(frame, ())]
+        return self.pressed, events
@@ -1,13 +1,92 @@
 from __future__ import division
+from collections import OrderedDict
+import hashlib
+import io
+import os
+import sys
+
 import pygame
 
-def image_cacher():
-    images = {}
-    def load(image_path, size=None, convert=False, flip=None, rotate=None):
-        if (image_path, convert, size, flip, rotate) in images:
-            return images[(image_path, convert, size, flip, rotate)]
+# where load_background keeps decoded and scaled backgrounds.
+BACKGROUND_CACHE_DIRECTORY = os.path.join('cache', 'backgrounds')
+
+# how many bytes of backgrounds load_background keeps on disk.
+BACKGROUND_CACHE_LIMIT = 64 * 1024 * 1024
+
+# how many bytes of surfaces the image cache keeps by default.
+DEFAULT_BUDGET = 128 * 1024 * 1024
+
+def key(image_path, size=None, convert=False, flip=None, rotate=None):
+    """Return the cache key `load` uses for the given arguments."""
+    return (image_path, convert, size, flip, rotate)
+
+def surface_bytes(surface):
+    """Return roughly how many bytes of pixels surface takes up."""
+    width, height = surface.get_size()
+    return width * height * surface.get_bytesize()
+
+class ImageCache(object):
+    """
+    Loads images, and keeps them around so each one is only loaded once.
+
+    Call it like `load(image_path, size=None, convert=False, flip=None,
+    rotate=None)`: the image is scaled to size, rotated, flipped and
+    converted to the display format, in that order.  The file is only
+    decoded if the plain image (`load(image_path)`) isn't in the cache, so
+    the other variants of an image that's been decoded already, or put in
+    with replace(), are made from that.
+
+    The cache holds at most about `budget` bytes of pixels.  Past that, the
+    least recently loaded images are dropped, except ones that something
+    else (a sprite's animation, say) still refers to: those are pinned,
+    since dropping them wouldn't free anything.  So if everything in the
+    cache is in use, it can go over budget.
 
-        image = pygame.image.load(image_path)
+    A subsurface (of an atlas page, say) keeps the whole surface it's part
+    of alive, so that whole surface is what's counted against the budget,
+    once however many of its subsurfaces are cached; it's only freed once
+    all of them have been dropped.  drop_subsurfaces() drops them all at
+    once.
+
+    Pinning counts references with sys.getrefcount, so it relies on
+    CPython's reference counting: a reference held anywhere at all (a
+    debugger's, or a local variable's) pins an image, and on interpreters
+    without sys.getrefcount nothing is pinned and the cache is plain LRU.
+
+    Attributes
+        budget: the most bytes of surfaces to keep.
+        nbytes: roughly how many bytes the cached surfaces take up.
+        hits, misses, evictions: how many loads were answered from the
+            cache, how many had to load the file, and how many images
+            have been dropped.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        # key -> surface, least recently used first
+        self.images = OrderedDict()
+        # id of a surface -> [how many cached images are that surface or
+        # part of it, its bytes].  Keyed by id so as not to pin it.
+        self.roots = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, image_path, size=None, convert=False, flip=None, rotate=None):
+        k = (image_path, convert, size, flip, rotate)
+        try:
+            image = self.images[k]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self.images.move_to_end(k)
+            return image
+
+        self.misses += 1
+        image = self.images.get((image_path, False, None, None, None))
+        if image is None:
+            image = pygame.image.load(image_path)
         if size:
             image = pygame.transform.scale(image, size)
         if rotate:
@@ -16,13 +95,191 @@ def image_cacher():
             image = pygame.transform.flip(image, *flip)
         if convert:
             image = image.convert()
-        images[(image_path, convert, size, flip, rotate)] = image
-
+        self._add(k, image)
         return image
-    return load
+
+    def replace(self, surface, image_path, size=None, convert=False, flip=None, rotate=None):
+        """Make the cache return surface for these arguments from now on."""
+        self._add((image_path, convert, size, flip, rotate), surface)
+
+    def contains(self, image_path, size=None, convert=False, flip=None, rotate=None):
+        """Return whether there's an image for these arguments already."""
+        return (image_path, convert, size, flip, rotate) in self.images
+
+    def clear(self):
+        """Drop every image, pinned or not."""
+        self.evictions += len(self.images)
+        self.images.clear()
+        self.roots.clear()
+        self.nbytes = 0
+
+    def drop_subsurfaces(self, keep=()):
+        """
+        Drop every image that's a subsurface of another surface (an atlas
+        page, say), pinned or not, except the subsurfaces of the surfaces in
+        keep.
+        """
+        keep = set(keep)
+        for k, surface in list(self.images.items()):
+            root = surface.get_abs_parent()
+            if root is not surface and root not in keep:
+                self._remove(k)
+                self.evictions += 1
+
+    def stats(self):
+        """Return a dict of the cache's numbers."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'images': len(self.images),
+                'pinned': sum(1 for k in self.images if self._pinned(k)),
+                'bytes': self.nbytes,
+                'budget': self.budget}
+
+    def _add(self, k, surface):
+        if k in self.images:
+            self._remove(k)
+        self.images[k] = surface
+        root = surface.get_abs_parent()
+        try:
+            self.roots[id(root)][0] += 1
+        except KeyError:
+            self.roots[id(root)] = [1, surface_bytes(root)]
+            self.nbytes += surface_bytes(root)
+        if self.nbytes > self.budget:
+            self._evict(keep=k)
+
+    def _remove(self, k):
+        root = id(self.images.pop(k).get_abs_parent())
+        self.roots[root][0] -= 1
+        if not self.roots[root][0]:
+            self.nbytes -= self.roots.pop(root)[1]
+
+    def _pinned(self, k):
+        # Only self.images and getrefcount's argument refer to an image
+        # nothing else is using.  Without sys.getrefcount (it's CPython's),
+        # nothing is pinned.
+        getrefcount = getattr(sys, 'getrefcount', None)
+        return getrefcount is not None and getrefcount(self.images[k]) > 2
+
+    def _evict(self, keep):
+        for k in list(self.images):
+            if self.nbytes <= self.budget:
+                break
+            if k == keep or self._pinned(k):
+                continue
+            self._remove(k)
+            self.evictions += 1
+
+def image_cacher(budget=DEFAULT_BUDGET):
+    """Return a new, empty ImageCache."""
+    return ImageCache(budget)
 
 load = image_cacher()
 
+def prune_cache(directory, limit, keep=()):
+    """
+    Delete the files in directory that were used longest ago (by access
+    time) until the rest take up at most limit bytes.  The files in keep
+    are never deleted.  It's only a cache, so files that can't be looked at
+    or deleted are skipped.
+    """
+    try:
+        names = os.listdir(directory)
+    except (IOError, OSError):
+        return
+    keep = set(os.path.normpath(filename) for filename in keep)
+    total = 0
+    files = []
+    for name in names:
+        filename = os.path.join(directory, name)
+        try:
+            stat = os.stat(filename)
+        except (IOError, OSError):
+            continue
+        total += stat.st_size
+        if os.path.normpath(filename) not in keep:
+            files.append((stat.st_atime, stat.st_size, filename))
+    for atime, size, filename in sorted(files):
+        if total <= limit:
+            break
+        try:
+            os.remove(filename)
+        except (IOError, OSError):
+            continue
+        total -= size
+
+def decode_background(image_path, size, cache_directory=BACKGROUND_CACHE_DIRECTORY):
+    """
+    Do the part of load_background that doesn't need the display (so it can
+    be done on another thread): return (image, filename, cached), where
+    image is the background scaled to size but not converted, filename is
+    the file its pixels are cached in, and cached is whether they came from
+    there.
+    """
+    size = tuple(size)
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    source = hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()[:16]
+    digest = hashlib.sha1(data).hexdigest()
+    filename = os.path.join(cache_directory, '{}-{}-{}x{}.rgb'.format(source, digest, *size))
+    try:
+        with open(filename, 'rb') as f:
+            image = pygame.image.frombuffer(f.read(), size, 'RGB')
+    except (IOError, OSError, ValueError):
+        image = pygame.image.load(io.BytesIO(data), image_path)
+        return pygame.transform.scale(image, size), filename, False
+    try:
+        # prune_cache goes by access time, which the file system may not
+        # keep up to date by itself.
+        os.utime(filename)
+    except (IOError, OSError):
+        pass
+    return image, filename, True
+
+def load_background(image_path, size, cache_directory=BACKGROUND_CACHE_DIRECTORY, loader=None,
+                    decoded=None, cache_limit=BACKGROUND_CACHE_LIMIT):
+    """
+    Return `load(image_path, size=size, convert=True)`, but keep the decoded
+    and scaled pixels in cache_directory, so the next time the game starts
+    a level with this background at this size, it skips decoding and
+    scaling.
+
+    The cached files are raw RGB pixels, named after the image's path, the
+    sha1 of the image file and the size.  Writing one deletes the ones made
+    from older versions of the same image, and then the least recently used
+    files past cache_limit bytes.  `loader` is the image cache to use
+    instead of `load`.  `decoded` is what decode_background returned for
+    this background, if it's been called already.
+    """
+    if loader is None:
+        loader = load
+    size = tuple(size)
+    if loader.contains(image_path, size=size, convert=True):
+        return loader(image_path, size=size, convert=True)
+
+    if decoded is None:
+        decoded = decode_background(image_path, size, cache_directory)
+    image, filename, cached = decoded
+    image = image.convert()
+    if not cached:
+        try:
+            if not os.path.isdir(cache_directory):
+                os.makedirs(cache_directory)
+            with open(filename + '.tmp', 'wb') as f:
+                f.write(pygame.image.tostring(image, 'RGB'))
+            os.replace(filename + '.tmp', filename)
+            source, digest = os.path.basename(filename).split('-')[:2]
+            for name in os.listdir(cache_directory):
+                if name.startswith(source + '-') and name.split('-')[1] != digest:
+                    os.remove(os.path.join(cache_directory, name))
+        except (IOError, OSError):
+            pass
+        prune_cache(cache_directory, cache_limit, keep=[filename])
+
+    loader.replace(image, image_path, size=size, convert=True)
+    return image
+
 if __name__ == '__main__':
     # make sure the image cache is working.
     pygame.init()
@@ -34,4 +291,3 @@ if __name__ == '__main__':
     bg1 = load('../images/backgrounds/bamboo.png', convert=True, size=(550, 323))
     bg2 = load('../images/backgrounds/bamboo.png', convert=True, size=(550, 323))
     print('bg1 is bg2: {}'.format(bg1 is bg2))
-
@@ -39,6 +39,9 @@ class Menu(object):
         self.actions = {}
         self.initial_repeat = pygame.key.get_repeat()
         self.repeat = (200, 70)
+        # functions to call when the highlighted item changes; shared with
+        # the submenus.
+        self.highlight_actions = []
 
     def add_item(self, item):
         """Add another item to the menu.  `item` should just be a string."""
@@ -63,10 +66,35 @@ class Menu(object):
         """
 
         submenu = Menu(self.screen, items, self.font, self.settings)
+        submenu.highlight_actions = self.highlight_actions
 
         self.__add_action(index, submenu)
         return submenu
 
+    def add_highlight_action(self, function):
+        """
+        Call `function(settings)` whenever an item is highlighted, in this
+        menu or any of its submenus, with the settings as they would be if
+        that item were clicked.  This is handy for getting ready for what
+        the player is likely to pick (e.g. loading the highlighted level).
+        """
+        self.highlight_actions.append(function)
+
+    def highlighted_settings(self):
+        """Return the settings as they'd be if the selected item were clicked."""
+        settings = dict(self.settings)
+        action = self.actions.get(self.selected)
+        if isinstance(action, (tuple, list)) and action[0] == 'settings':
+            settings[action[1]] = action[2]
+        return settings
+
+    def on_highlight(self):
+        """Call the highlight actions for the selected item."""
+        if self.highlight_actions:
+            settings = self.highlighted_settings()
+            for function in self.highlight_actions:
+                function(settings)
+
     def change_settings(self, index, setting, value):
         """
         When a menu item associated with the given index is clicked,
@@ -97,6 +125,23 @@ class Menu(object):
         self.screen.blit(draw_surf, (menu_x, menu_y))
         pygame.draw.polygon(self.screen, self.SELECTOR_COLOR, ([sx,sy], [sx, sy + ind_height], [sx + 10, (2 *sy + ind_height) / 2]))
 
+    def draw_progress(self, done, total):
+        """Show a loading screen, with a bar that's done/total full."""
+        label = self.font.render('Loading', 1, self.FONT_COLOR)
+        width = self.screen.get_width() // 2
+        height = label.get_height()
+        x = (self.screen.get_width() - width) // 2
+        y = self.screen.get_height() // 2
+
+        self.screen.fill(self.BG_COLOR)
+        self.screen.blit(label, (x, y - height - self.SPACE))
+        pygame.draw.rect(self.screen, self.FONT_COLOR, (x, y, width, height), 1)
+        if total:
+            pygame.draw.rect(self.screen, self.SELECTOR_COLOR, (x + 2, y + 2, (width - 4) * done // total, height - 4))
+        pygame.display.update()
+        # keep the window responsive while the game waits.
+        pygame.event.pump()
+
     def change_select(self, direction):
         """Change the current menu selection."""
         if direction == self.UP:
@@ -111,6 +156,8 @@ class Menu(object):
             else:
                 self.selected += 1
 
+        self.on_highlight()
+
 
     def _reset_repeat(self):
         """Change key repeat back to what it was before the menu was called."""
@@ -147,11 +194,17 @@ class Menu(object):
             if action[0] == 'start':
                 game = action[1]()
                 self._reset_repeat()
+                if hasattr(game, 'preload'):
+                    game.preload(self.screen, self.settings, self.draw_progress)
                 game.main(self.screen, self.settings)
                 pygame.key.set_repeat(*self.repeat)
 
     def add_start_action(self, index, Game):
-        """Resets key repeat and calls `Game.main(self.screen, self.settings)`"""
+        """
+        Resets key repeat and calls `Game.main(self.screen, self.settings)`.
+        If the game has a `preload(screen, settings, progress)` method, that's
+        called first, with draw_progress as progress.
+        """
         self.__add_action(index, ('start', Game))
 
     def add_back_action(self, index):
@@ -172,6 +225,7 @@ class Menu(object):
 
     def mainloop(self):
         pygame.key.set_repeat(*self.repeat)
+        self.on_highlight()
         pygame.display.update()
         clock = pygame.time.Clock()
         while True:
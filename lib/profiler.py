@@ -0,0 +1,211 @@
+"""
+Frame-time instrumentation for the game loop.
+
+A Profiler times named stages of each frame (event handling, updating,
+drawing, flipping, and every layer's update and draw) and counts things
+that happen in them (blits, collision queries, sprites updated).  It keeps
+the last WINDOW frames of each, so it can report rolling percentiles, draw
+them as an overlay, and dump them to a JSON file.
+
+When profiling is off the game uses NULL_PROFILER, whose methods do nothing.
+"""
+
+from __future__ import division
+from collections import OrderedDict, deque
+import json
+import math
+import time
+
+import pygame
+
+# how many frames the rolling statistics cover.
+WINDOW = 600
+
+# the percentiles reported for everything.
+PERCENTILES = (50, 95, 99)
+
+# the overlay is only re-rendered this often (in frames), since rendering
+# text every frame would show up in the numbers it's showing.
+OVERLAY_REFRESH = 15
+
+
+def percentile(values, p):
+    """Return the p-th percentile (nearest rank) of the sorted list values."""
+    if not values:
+        return 0
+    rank = int(math.ceil(p / 100 * len(values))) - 1
+    return values[max(0, rank)]
+
+
+def summarize(values):
+    """Return a dict with the mean, percentiles and max of values."""
+    ordered = sorted(values)
+    summary = {'mean': sum(ordered) / len(ordered) if ordered else 0,
+               'max': ordered[-1] if ordered else 0}
+    for p in PERCENTILES:
+        summary['p{}'.format(p)] = percentile(ordered, p)
+    return summary
+
+
+class _Stage(object):
+    # Context manager that adds the time spent inside it to a stage.
+    __slots__ = ('totals', 'name', 'start')
+
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.totals[self.name] = self.totals.get(self.name, 0) + elapsed
+
+
+class Profiler(object):
+    """
+    Collects per-frame stage times and counts.
+
+    Args
+        window: how many frames the rolling statistics cover.
+
+    Time a stage with `with profiler.stage(name): ...`, count with
+    `profiler.count(name, n)`, and call `end_frame()` once a frame.  A stage
+    or counter that's used more than once in a frame (like updates in fixed
+    step mode) is summed over the frame.
+    """
+    enabled = True
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.frames = 0
+        self.overlay = False
+        # name -> deque of per-frame seconds or counts.
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self._stage_totals = {}
+        self._counts = {}
+        self._stages = {}
+        self._frame_start = time.perf_counter()
+        self._overlay_surface = None
+        self._font = None
+
+    def stage(self, name):
+        try:
+            return self._stages[name]
+        except KeyError:
+            stage = self._stages[name] = _Stage(self._stage_totals, name)
+            return stage
+
+    def count(self, name, n=1):
+        self._counts[name] = self._counts.get(name, 0) + n
+
+    def start_frame(self):
+        """Start timing a frame, without recording the time since the last one."""
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Record this frame's numbers and start the next frame."""
+        now = time.perf_counter()
+        self._stage_totals['frame'] = now - self._frame_start
+        self._frame_start = now
+        self._record(self.stages, self._stage_totals)
+        self._record(self.counters, self._counts)
+        self.frames += 1
+
+    def _record(self, history, totals):
+        for name in totals:
+            if name not in history:
+                history[name] = deque(maxlen=self.window)
+        for name, values in history.items():
+            values.append(totals.get(name, 0))
+        totals.clear()
+
+    def summary(self):
+        """
+        Return a dict with the number of frames, and the mean, p50, p95,
+        p99 and max of every stage (in seconds) and counter over the last
+        `window` frames.
+        """
+        return {'frames': self.frames,
+                'stages': dict((name, summarize(values))
+                               for name, values in self.stages.items()),
+                'counters': dict((name, summarize(values))
+                                 for name, values in self.counters.items())}
+
+    def dump(self, filename):
+        """Write summary() to filename as JSON."""
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=1, sort_keys=True)
+
+    def draw(self, surface):
+        """
+        Draw the statistics in the top right corner if overlay is on.
+        Return the rect drawn in, or None.
+        """
+        if not self.overlay:
+            return None
+        if self._overlay_surface is None or self.frames % OVERLAY_REFRESH == 0:
+            self._overlay_surface = self._render_overlay()
+        return surface.blit(self._overlay_surface,
+                            (surface.get_width() - self._overlay_surface.get_width() - 10, 10))
+
+    def _render_overlay(self):
+        if self._font is None:
+            self._font = pygame.font.SysFont('monospace', 14)
+        lines = ['{:<24}{:>8}{:>8}{:>8}'.format('ms', 'p50', 'p95', 'p99')]
+        for name, values in self.stages.items():
+            s = summarize(values)
+            lines.append('{:<24}{:>8.2f}{:>8.2f}{:>8.2f}'.format(
+                name, s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000))
+        for name, values in self.counters.items():
+            s = summarize(values)
+            lines.append('{:<24}{:>8g}{:>8g}{:>8g}'.format(name, s['p50'], s['p95'], s['p99']))
+
+        rendered = [self._font.render(line, 1, (255, 255, 255)) for line in lines]
+        height = sum(r.get_height() for r in rendered)
+        overlay = pygame.Surface((max(r.get_width() for r in rendered) + 10, height + 10),
+                                 pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 160))
+        y = 5
+        for r in rendered:
+            overlay.blit(r, (5, y))
+            y += r.get_height()
+        return overlay
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullProfiler(object):
+    """A Profiler that does nothing, for when profiling is off."""
+    enabled = False
+    overlay = False
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, n=1):
+        pass
+
+    def start_frame(self):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw(self, surface):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
@@ -16,7 +16,7 @@
 # TODO: Feature idea: if the same image file is specified, re-use the Surface object. (Make this optional though.)
 
 from __future__ import division
-import pygame, time
+import pygame, time, weakref
 from . import images
 
 # setting up constants
@@ -36,8 +36,34 @@ SOUTH = 'south'
 SOUTHEAST = 'southeast'
 
 
+class AnimationClock(object):
+    # A clock for animations that the game moves forward, instead of the
+    # wall clock. Every animation timed by the same AnimationClock stays in
+    # step with the game: pausing the clock freezes them all, a scale below 1
+    # slows them all down, and a game running faster than real time (like a
+    # headless one) plays them that much faster too.
+    #
+    # Reading the time is just an attribute lookup, so there's no system
+    # call every time an animation works out its current frame.
+    def __init__(self, now=0.0):
+        # @param now The time (in seconds) to start the clock at.
+        self.now = now
+        self.scale = 1.0 # 0.5 means animations play at half speed
+        self.paused = False
+
+    def tick(self, dt):
+        # Move the clock forward by dt seconds of game time.
+        if not self.paused:
+            self.now += dt * self.scale
+
+
+# Animations created without a clock are timed by this AnimationClock; if
+# it's None, they're timed by the wall clock.
+default_clock = None
+
+
 class PygAnimation(object):
-    def __init__(self, frames, loop=True, **kwargs):
+    def __init__(self, frames, loop=True, clock=None, **kwargs):
         # Constructor function for the animation object. Starts off in the STOPPED state.
         #
         # @param frames
@@ -47,6 +73,8 @@ class PygAnimation(object):
         #     Note that the images and duration cannot be changed. A new PygAnimation object
         #     will have to be created.
         # @param loop Tells the animation object to keep playing in a loop.
+        # @param clock The AnimationClock that times the animation. Defaults
+        #     to default_clock.
         # all other keyword arguments will be passed into images.load() on
         # loading the images.
 
@@ -64,8 +92,20 @@ class PygAnimation(object):
         # e.g. if _durations is [1, 1, 2.5], then _startTimes will be [0, 1, 2, 4.5]
         self._startTimes = None
 
-        # if the sprites are transformed, the originals are kept in _images
-        # and the transformed sprites are kept in _transformedImages.
+        # _sources has the (filename, images.load() keyword arguments) each
+        # frame was loaded with, or None for frames given as Surfaces.
+        self._sources = []
+
+        # the transforms (flip(), scale(), ...) applied to the frames, as a
+        # chain (see addTransform()), and the transformed frames, which come
+        # from transformedFrame() and so are shared with everything else
+        # that transforms the same frames the same way.
+        self._transforms = ()
+        self._chainImages = []
+
+        # once the Surface method wrappers (convert(), set_alpha(), ...)
+        # have been called, the frames are copied into _transformedImages,
+        # which belong to this animation alone.
         self._transformedImages = []
 
         self._state = STOPPED # The state is always either PLAYING, PAUSED, or STOPPED
@@ -76,19 +116,16 @@ class PygAnimation(object):
         self._playingStartTime = 0 # the time that the play() function was last called.
         self._pausedStartTime = 0 # the time that the pause() function was last called.
 
+        if clock is None:
+            clock = default_clock
+        self.clock = clock # the AnimationClock, or None for the wall clock.
+        # the frame number last looked up; see _propGetCurrentFrameNum().
+        self._cursor = 0
+
         if frames != '_copy': # ('_copy' is passed for frames by the getCopies() method)
             self.numFrames = len(frames)
             assert self.numFrames > 0, 'Must contain at least one frame.'
-            for i in range(self.numFrames):
-                # load each frame of animation into _images
-                frame = frames[i]
-                assert type(frame) in (list, tuple) and len(frame) == 2, 'Frame %s has incorrect format.' % (i)
-                assert isinstance(frame[0], (str, pygame.Surface)), 'Frame %s image must be a string filename or a pygame.Surface' % (i)
-                assert frame[1] > 0, 'Frame %s duration must be greater than zero.' % (i)
-                if isinstance(frame[0], str):
-                    frame = (images.load(frame[0], **kwargs), frame[1])
-                self._images.append(frame[0])
-                self._durations.append(frame[1])
+            self._images, self._durations, self._sources = [list(l) for l in loadFrames(frames, kwargs)]
             self._startTimes = self._getStartTimes()
 
 
@@ -105,6 +142,8 @@ class PygAnimation(object):
         # Reverses the order of the ground_images.
         self.elapsed = self._startTimes[-1] - self.elapsed
         self._images.reverse()
+        self._sources.reverse()
+        self._chainImages.reverse()
         self._transformedImages.reverse()
         self._durations.reverse()
 
@@ -128,8 +167,11 @@ class PygAnimation(object):
         # copies using constructor function instead.
         retval = []
         for i in range(numCopies):
-            newAnim = PygAnimation('_copy', loop=self.loop)
+            newAnim = PygAnimation('_copy', loop=self.loop, clock=self.clock)
             newAnim._images = self._images[:]
+            newAnim._sources = self._sources[:]
+            newAnim._transforms = self._transforms
+            newAnim._chainImages = self._chainImages[:]
             newAnim._transformedImages = self._transformedImages[:]
             newAnim._durations = self._durations[:]
             newAnim._startTimes = self._startTimes[:]
@@ -158,14 +200,23 @@ class PygAnimation(object):
         destSurface.blit(self.getFrame(frameNum), dest)
 
 
+    def _now(self):
+        # Returns the current time by this animation's clock.
+        if self.clock is None:
+            return time.time()
+        return self.clock.now
+
+
     def getFrame(self, frameNum):
         # Returns the pygame.Surface object of the frameNum-th frame in this
         # animation object. If there is a transformed version of the frame,
         # it will return that one.
-        if self._transformedImages == []:
-            return self._images[frameNum]
-        else:
+        if self._transformedImages:
             return self._transformedImages[frameNum]
+        elif self._chainImages:
+            return self._chainImages[frameNum]
+        else:
+            return self._images[frameNum]
 
 
     def getCurrentFrame(self):
@@ -183,12 +234,17 @@ class PygAnimation(object):
         # This is handy to do for multiple transformation, where calling
         # the rotation or scaling functions multiple times results in
         # degraded/noisy images.
+        self._transforms = ()
+        self._chainImages = []
         self._transformedImages = []
 
     def makeTransformsPermanent(self):
-        self._images = self._transformedImages
-        #for i in range(len(self._transformedImages)):
-        #    self._images[i].blit(self._transformedImages[i], (0,0))
+        # Make the transformed frames the animation's frames.
+        if self._transformedImages or self._chainImages:
+            self._images = [self.getFrame(i) for i in range(len(self._images))]
+            # the frames aren't what their files load as anymore.
+            self._sources = [None] * len(self._images)
+        self.clearTransforms()
 
     def blitFrameNum(self, frameNum, destSurface, dest):
         # Draws the specified frame of the animation object. This ignores the
@@ -248,7 +304,7 @@ class PygAnimation(object):
         # NOTE: Don't adjust the self.state property, only self._state
 
         if startTime is None:
-            startTime = time.time()
+            startTime = self._now()
 
         if self._state == PLAYING:
             if self.isFinished():
@@ -271,14 +327,14 @@ class PygAnimation(object):
         # NOTE: Don't adjust the self.state property, only self._state
 
         if startTime is None:
-            startTime = time.time()
+            startTime = self._now()
 
         if self._state == PAUSED:
             return # do nothing
         elif self._state == PLAYING:
             self._pausedStartTime = startTime
         elif self._state == STOPPED:
-            rightNow = time.time()
+            rightNow = self._now()
             self._playingStartTime = rightNow
             self._pausedStartTime = rightNow
         self._state = PAUSED
@@ -434,52 +490,61 @@ class PygAnimation(object):
         # Internal-method. Creates the Surface objects for the _transformedImages list.
         # Don't call this method.
         if self._transformedImages == []:
-            self._transformedImages = [surf.copy() for surf in self._images]
+            self._transformedImages = [self.getFrame(i).copy() for i in range(len(self._images))]
+
+
+    def _transform(self, name, *args):
+        # Internal-method. Adds the pygame.transform function name, called
+        # with args, to the transforms applied to every frame.
+        if self._transformedImages:
+            # these frames have been changed by the Surface method wrappers,
+            # so they can only be transformed one by one.
+            self._transformedImages = [applyTransforms(surf, ((name, args),)) for surf in self._transformedImages]
+            return
+        self._transforms = addTransform(self._transforms, name, *args)
+        if self._transforms:
+            self._chainImages = [transformedFrame(surf, source, self._transforms)
+                                 for surf, source in zip(self._images, self._sources)]
+        else:
+            self._chainImages = []
 
 
     # Transformation methods.
     # (These are analogous to the pygame.transform.* functions, except they
     # are applied to all frames of the animation object.
+    # Transforms are composed with the ones before them where they can be
+    # (two flips make one flip, or none), and each transformed frame is only
+    # made once; see addTransform() and transformedFrame().
     def flip(self, xbool, ybool):
         # Flips the image horizontally, vertically, or both.
         # See http://pygame.org/docs/ref/transform.html#pygame.transform.flip
-        self._makeTransformedSurfacesIfNeeded()
-        for i in range(len(self._images)):
-            self._transformedImages[i] = pygame.transform.flip(self.getFrame(i), xbool, ybool)
+        self._transform('flip', xbool, ybool)
 
 
     def scale(self, width_height):
         # NOTE: Does not support the DestSurface parameter
         # Increases or decreases the size of the images.
         # See http://pygame.org/docs/ref/transform.html#pygame.transform.scale
-        self._makeTransformedSurfacesIfNeeded()
-        for i in range(len(self._images)):
-            self._transformedImages[i] = pygame.transform.scale(self.getFrame(i), width_height)
+        self._transform('scale', tuple(width_height))
 
 
     def rotate(self, angle):
         # Rotates the image.
         # See http://pygame.org/docs/ref/transform.html#pygame.transform.rotate
-        self._makeTransformedSurfacesIfNeeded()
-        for i in range(len(self._images)):
-            self._transformedImages[i] = pygame.transform.rotate(self.getFrame(i), angle)
+        self._transform('rotate', angle)
 
 
     def rotozoom(self, angle, scale):
         # Rotates and scales the image simultaneously.
         # See http://pygame.org/docs/ref/transform.html#pygame.transform.rotozoom
-        self._makeTransformedSurfacesIfNeeded()
-        for i in range(len(self._images)):
-            self._transformedImages[i] = pygame.transform.rotozoom(self.getFrame(i), angle, scale)
+        self._transform('rotozoom', angle, scale)
 
 
     def scale2x(self):
         # NOTE: Does not support the DestSurface parameter
         # Double the size of the image using an efficient algorithm.
         # See http://pygame.org/docs/ref/transform.html#pygame.transform.scale2x
-        self._makeTransformedSurfacesIfNeeded()
-        for i in range(len(self._images)):
-            self._transformedImages[i] = pygame.transform.scale2x(self.getFrame(i))
+        self._transform('scale2x')
 
 
     def smoothscale(self, width_height):
@@ -487,9 +552,7 @@ class PygAnimation(object):
         # Scales the image smoothly. (Computationally more expensive and
         # slower but produces a better scaled image.)
         # See http://pygame.org/docs/ref/transform.html#pygame.transform.smoothscale
-        self._makeTransformedSurfacesIfNeeded()
-        for i in range(len(self._images)):
-            self._transformedImages[i] = pygame.transform.smoothscale(self.getFrame(i), width_height)
+        self._transform('smoothscale', tuple(width_height))
 
 
 
@@ -570,7 +633,7 @@ class PygAnimation(object):
             # we need to modify the _playingStartTime so that the rest of
             # the animation will play, and then stop. (Otherwise, the
             # animation will immediately stop playing if it has already looped.)
-            self._playingStartTime = time.time() - self.elapsed
+            self._playingStartTime = self._now() - self.elapsed
         self._loop = bool(loop)
 
     loop = property(_propGetLoop, _propSetLoop)
@@ -615,7 +678,7 @@ class PygAnimation(object):
         else:
             elapsed = getInBetweenValue(0, elapsed, self._startTimes[-1])
 
-        rightNow = time.time()
+        rightNow = self._now()
         self._playingStartTime = rightNow - (elapsed * self.rate)
 
         if self.state in (PAUSED, STOPPED):
@@ -639,7 +702,7 @@ class PygAnimation(object):
             # if playing, then draw the current frame (based on when the animation
             # started playing). If not looping and the animation has gone through
             # all the frames already, then draw the last frame.
-            elapsed = (time.time() - self._playingStartTime) * self.rate
+            elapsed = (self._now() - self._playingStartTime) * self.rate
         elif self._state == PAUSED:
             # if paused, then draw the frame that was playing at the time the
             # PygAnimation object was paused
@@ -657,7 +720,8 @@ class PygAnimation(object):
     def _propGetCurrentFrameNum(self):
         # Return the frame number of the frame that will be currently
         # displayed if the animation object were drawn right now.
-        return findStartTime(self._startTimes, self.elapsed)
+        self._cursor = findFrame(self._startTimes, self.elapsed, self._cursor)
+        return self._cursor
 
 
     def _propSetCurrentFrameNum(self, frameNum):
@@ -672,6 +736,227 @@ class PygAnimation(object):
 
 
 
+class Clip(object):
+    # The frames of an animation and how long each lasts, without any of the
+    # state of playing it, so that every sprite showing the same animation
+    # can share one Clip. Each sprite plays it with its own Playhead, from
+    # Clip.playhead().
+    #
+    # Clips aren't meant to be changed once they're made: the frames are
+    # kept in tuples, and transforming a clip (flip(), say) gives another
+    # Clip. Get them from getClip() to share them.
+    __slots__ = ('images', 'durations', 'startTimes', 'loop', 'numFrames',
+                 'sources', 'transforms', 'original', '_variants')
+
+    def __init__(self, frames, loop=True, **kwargs):
+        # @param frames A list of (image, duration) tuples, like the frames
+        #     of a PygAnimation.
+        # @param loop Tells the playheads to keep playing the clip in a loop.
+        # all other keyword arguments will be passed into images.load() on
+        # loading the images.
+        self.numFrames = len(frames)
+        assert self.numFrames > 0, 'Must contain at least one frame.'
+        self.images, self.durations, self.sources = loadFrames(frames, kwargs)
+        # the time each frame starts, and then the length of the whole clip,
+        # just like PygAnimation._startTimes.
+        startTimes = [0]
+        for duration in self.durations:
+            startTimes.append(startTimes[-1] + duration)
+        self.startTimes = tuple(startTimes)
+        self.loop = loop
+        # the transform chain that makes this clip from original.
+        self.transforms = ()
+        self.original = self
+        # transform chain -> the Clip it makes from this one; only the
+        # original clip keeps these.
+        self._variants = {}
+
+
+    def playhead(self, clock=None):
+        # Returns a new, stopped Playhead for this clip.
+        return Playhead(self, clock)
+
+
+    def transformed(self, name, *args):
+        # Returns this clip with the pygame.transform function name, called
+        # with args, applied to every frame. Each variant of a clip is only
+        # made once, and every frame of it comes from transformedFrame().
+        original = self.original
+        chain = addTransform(self.transforms, name, *args)
+        if not chain:
+            return original
+        try:
+            return original._variants[chain]
+        except KeyError:
+            pass
+        variant = Clip.__new__(Clip)
+        variant.images = tuple(transformedFrame(surf, source, chain)
+                               for surf, source in zip(original.images, original.sources))
+        variant.durations = original.durations
+        variant.sources = original.sources
+        variant.startTimes = original.startTimes
+        variant.loop = original.loop
+        variant.numFrames = original.numFrames
+        variant.transforms = chain
+        variant.original = original
+        variant._variants = None
+        original._variants[chain] = variant
+        return variant
+
+
+    def flip(self, xbool, ybool):
+        # Returns this clip flipped horizontally, vertically, or both; e.g.
+        # the right-facing version of a left-facing walk.
+        return self.transformed('flip', xbool, ybool)
+
+
+# The Clips made by getClip(), by the arguments they were made with.
+_clips = {}
+
+def getClip(frames, loop=True, **kwargs):
+    # Returns the Clip of these frames, made the first time it's asked for
+    # and shared after that. Takes the same arguments as Clip().
+    key = (tuple(frames), loop, tuple(sorted(kwargs.items())))
+    try:
+        return _clips[key]
+    except KeyError:
+        clip = _clips[key] = Clip(frames, loop, **kwargs)
+        return clip
+
+
+def clearClips():
+    # Forget the Clips made by getClip(), so they're made again (from the
+    # images images.load() returns now) the next time they're asked for.
+    _clips.clear()
+
+
+class Playhead(object):
+    # Plays a Clip for one sprite: which clip, the clock that times it,
+    # whether it's playing, when it started (or paused), and which frame
+    # it was last on. That's all a sprite has to have of its own to show
+    # an animation; the frames themselves are the Clip's.
+    #
+    # A Playhead picks its frames exactly the way a PygAnimation of the
+    # same frames would, and has the same play(), pause(), stop(),
+    # getCurrentFrame() and blit() methods, so it can stand in for one
+    # that isn't transformed.
+    __slots__ = ('clip', 'clock', 'rate', '_state', '_playingStartTime',
+                 '_pausedStartTime', '_cursor')
+
+    def __init__(self, clip, clock=None):
+        # @param clip The Clip to play.
+        # @param clock The AnimationClock that times it. Defaults to
+        #     default_clock.
+        if clock is None:
+            clock = default_clock
+        self.clip = clip
+        self.clock = clock
+        self.rate = 1.0 # 2.0 means play the clip twice as fast
+        self._state = STOPPED
+        self._playingStartTime = 0 # the time that play() was last called.
+        self._pausedStartTime = 0 # the time that pause() was last called.
+        self._cursor = 0 # the frame number last looked up.
+
+
+    def _now(self):
+        # Returns the current time by this playhead's clock.
+        if self.clock is None:
+            return time.time()
+        return self.clock.now
+
+
+    def play(self, startTime=None):
+        # Start playing the clip; see PygAnimation.play().
+        if startTime is None:
+            startTime = self._now()
+
+        if self._state == PLAYING:
+            if self.isFinished():
+                self._playingStartTime = startTime
+        elif self._state == STOPPED:
+            self._playingStartTime = startTime
+        elif self._state == PAUSED:
+            self._playingStartTime = startTime - (self._pausedStartTime - self._playingStartTime)
+        self._state = PLAYING
+
+
+    def pause(self, startTime=None):
+        # Keep showing the current frame; see PygAnimation.pause().
+        if startTime is None:
+            startTime = self._now()
+
+        if self._state == PAUSED:
+            return
+        elif self._state == PLAYING:
+            self._pausedStartTime = startTime
+        elif self._state == STOPPED:
+            rightNow = self._now()
+            self._playingStartTime = rightNow
+            self._pausedStartTime = rightNow
+        self._state = PAUSED
+
+
+    def stop(self):
+        # Go back to the first frame and stop playing.
+        self._state = STOPPED
+
+
+    def isFinished(self):
+        # Returns True if the clip doesn't loop and has finished playing.
+        return not self.clip.loop and self.elapsed >= self.clip.startTimes[-1]
+
+
+    def _propGetState(self):
+        return self._state
+
+    state = property(_propGetState)
+
+
+    def _propGetElapsed(self):
+        # How far into the clip the playhead is, in seconds; worked out the
+        # same way as PygAnimation.elapsed.
+        if self._state == STOPPED:
+            return 0
+
+        if self._state == PLAYING:
+            elapsed = (self._now() - self._playingStartTime) * self.rate
+        else:
+            elapsed = (self._pausedStartTime - self._playingStartTime) * self.rate
+        length = self.clip.startTimes[-1]
+        if self.clip.loop:
+            elapsed = elapsed % length
+        else:
+            elapsed = getInBetweenValue(0, elapsed, length)
+        elapsed += 0.00001 # done to compensate for rounding errors
+        return elapsed
+
+    elapsed = property(_propGetElapsed)
+
+
+    def _propGetCurrentFrameNum(self):
+        # Return the number of the frame showing right now.
+        self._cursor = findFrame(self.clip.startTimes, self.elapsed, self._cursor)
+        return self._cursor
+
+    currentFrameNum = property(_propGetCurrentFrameNum)
+
+
+    def getFrame(self, frameNum):
+        # Returns the pygame.Surface of the clip's frameNum-th frame.
+        return self.clip.images[frameNum]
+
+
+    def getCurrentFrame(self):
+        # Returns the pygame.Surface of the frame showing right now.
+        return self.clip.images[self.currentFrameNum]
+
+
+    def blit(self, destSurface, dest):
+        # Draws the frame showing right now to destSurface at dest.
+        destSurface.blit(self.getCurrentFrame(), dest)
+
+
+
 class PygConductor(object):
     def __init__(self, *animations):
         assert len(animations) > 0, 'at least one PygAnimation object is required'
@@ -701,14 +986,14 @@ class PygConductor(object):
 
     def play(self, startTime=None):
         if startTime is None:
-            startTime = time.time()
+            startTime = self._animations[0]._now()
 
         for animObj in self._animations:
             animObj.play(startTime)
 
     def pause(self, startTime=None):
         if startTime is None:
-            startTime = time.time()
+            startTime = self._animations[0]._now()
 
         for animObj in self._animations:
             animObj.pause(startTime)
@@ -818,6 +1103,125 @@ def getInBetweenValue(lowerBound, value, upperBound):
     return value
 
 
+def loadFrames(frames, kwargs):
+    # Returns (images, durations, sources) tuples for a list of (image,
+    # duration) frames, loading images given as filenames with
+    # images.load(filename, **kwargs). sources has the (filename, kwargs)
+    # each frame was loaded with, or None for frames given as Surfaces.
+    loaded = []
+    for i, frame in enumerate(frames):
+        assert type(frame) in (list, tuple) and len(frame) == 2, 'Frame %s has incorrect format.' % (i)
+        assert isinstance(frame[0], (str, pygame.Surface)), 'Frame %s image must be a string filename or a pygame.Surface' % (i)
+        assert frame[1] > 0, 'Frame %s duration must be greater than zero.' % (i)
+        if isinstance(frame[0], str):
+            loaded.append((images.load(frame[0], **kwargs), frame[1], (frame[0], kwargs)))
+        else:
+            loaded.append((frame[0], frame[1], None))
+    return tuple(zip(*loaded))
+
+
+# Transform chains
+#
+# A transform chain is a tuple of (name, args) steps, each a function from
+# pygame.transform and the arguments after the surface to call it with,
+# e.g. (('scale', ((64, 64),)), ('flip', (True, False))).
+
+def addTransform(chain, name, *args):
+    # Returns chain with the transform added on the end, composed with the
+    # last step where the two make one: two flips make one flip (or none at
+    # all), two rotations one rotation, and a scale or smoothscale replaces
+    # a scale or smoothscale just before it, so the frames are only scaled
+    # once.
+    if chain:
+        lastName, lastArgs = chain[-1]
+        if name == 'flip' and lastName == 'flip':
+            flip = (lastArgs[0] != args[0], lastArgs[1] != args[1])
+            if flip == (False, False):
+                return chain[:-1]
+            return chain[:-1] + (('flip', flip),)
+        if name == 'rotate' and lastName == 'rotate':
+            angle = (lastArgs[0] + args[0]) % 360
+            if not angle:
+                return chain[:-1]
+            return chain[:-1] + (('rotate', (angle,)),)
+        if name in ('scale', 'smoothscale') and lastName in ('scale', 'smoothscale'):
+            return chain[:-1] + ((name, args),)
+    if name == 'flip' and not any(args) or name == 'rotate' and not args[0] % 360:
+        return chain
+    return chain + ((name, tuple(args)),)
+
+
+def applyTransforms(surface, chain):
+    # Returns a new Surface of surface transformed by every step of chain.
+    for name, args in chain:
+        surface = getattr(pygame.transform, name)(surface, *args)
+    return surface
+
+
+def loadArguments(kwargs, chain):
+    # Returns the images.load() keyword arguments that load an image the
+    # way kwargs does and then transform it by chain, or None if
+    # images.load() can't. (It scales, rotates and flips, in that order.)
+    size = kwargs.get('size')
+    angle = kwargs.get('rotate') or 0
+    flip = kwargs.get('flip') or (False, False)
+    for name, args in chain:
+        if name == 'flip':
+            flip = (flip[0] != args[0], flip[1] != args[1])
+        elif name == 'rotate' and flip == (False, False):
+            angle = (angle + args[0]) % 360
+        elif name == 'scale' and not angle:
+            # flipping and scaling can be done in either order.
+            size = args[0]
+        else:
+            return None
+    arguments = dict(kwargs, size=size, rotate=angle or None, flip=flip if any(flip) else None)
+    return dict((k, v) for k, v in arguments.items() if v is not None)
+
+
+# Surface -> {transform chain: the transformed Surface}, for frames that
+# images.load() can't make (or that weren't loaded from files). An entry
+# goes away with the Surface it was made from.
+_transformed = weakref.WeakKeyDictionary()
+
+def transformedFrame(surface, source, chain):
+    # Returns surface transformed by chain, made only the first time it's
+    # asked for. source is the (filename, kwargs) surface was loaded with
+    # by images.load(), or None.
+    #
+    # When images.load() can make the transformed frame itself, it does:
+    # then it's kept in the image cache (and packed into a level's atlas)
+    # like any other image, and the flipped frames of a left-facing
+    # animation are the very same Surfaces as the ones loaded with flip.
+    if source is not None:
+        arguments = loadArguments(source[1], chain)
+        if arguments is not None:
+            return images.load(source[0], **arguments)
+    variants = _transformed.setdefault(surface, {})
+    try:
+        return variants[chain]
+    except KeyError:
+        result = variants[chain] = applyTransforms(surface, chain)
+        return result
+
+
+def findFrame(startTimes, elapsed, cursor):
+    # Returns the number of the frame showing elapsed seconds into an
+    # animation with these startTimes, where cursor is the frame number
+    # looked up last time.
+    #
+    # Between two lookups an animation has usually stayed on the same
+    # frame or moved on to the next one, so those are checked before
+    # searching all the start times.
+    lastFrame = len(startTimes) - 2
+    if cursor <= lastFrame and startTimes[cursor] <= elapsed < startTimes[cursor + 1]:
+        return cursor
+    cursor += 1
+    if cursor <= lastFrame and startTimes[cursor] <= elapsed < startTimes[cursor + 1]:
+        return cursor
+    return findStartTime(startTimes, elapsed)
+
+
 def findStartTime(startTimes, target):
     # With startTimes as a list of sequential numbers and target as a number,
     # returns the index of the number in startTimes that preceeds target.
@@ -0,0 +1,266 @@
+"""
+Ways of getting a frame of the game onto the screen.
+
+A Renderer draws the background and the TileMap's layers, lets the game say
+where else it drew (the lifebars, say), and then shows the frame.
+
+Renderer redraws and flips the whole screen every frame.  ScrollRenderer
+keeps the static layers (the ones below the sprites) drawn on a surface that
+is scrolled along with the camera, so only the strips of the map that come
+into view have to be drawn.  DirtyRectRenderer does that too, and while the
+camera stays put it only redraws and updates the parts of the screen that
+sprites (and whatever else was marked) covered last frame or cover now.
+"""
+
+from __future__ import division
+
+import pygame
+
+from . import tmx
+from .profiler import NULL_PROFILER
+
+
+def split_layers(tilemap):
+    """
+    Return (static layers, sprite layers) of the tilemap's visible layers,
+    or (None, None) if some static layer is above a sprite layer.
+    """
+    static = []
+    dynamic = []
+    for layer in tilemap.layers:
+        if not layer.visible:
+            continue
+        if isinstance(layer, tmx.SpriteLayer):
+            dynamic.append(layer)
+        elif dynamic:
+            return None, None
+        else:
+            static.append(layer)
+    return static, dynamic
+
+
+class StaticLayers(object):
+    """
+    Layers drawn onto a transparent, viewport-sized surface that follows
+    the viewport around.
+
+    When the viewport moves by less than its size, the surface is scrolled
+    and only the strips that came into view are drawn, so following the
+    player costs about as much as the edge of the screen instead of all of
+    it.  Blitting the surface onto the background gives the same pixels as
+    drawing the layers on it one by one, as long as the layers don't have
+    partly transparent pixels on top of each other.  When a layer's version
+    changes (a tile was set, say), the whole surface is drawn again.
+
+    Args
+        size: the viewport size.
+    """
+    def __init__(self, size):
+        self.surface = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+        self.layers = None
+        self.viewport = None
+        # the layers' versions when the surface was drawn
+        self.versions = None
+
+    def invalidate(self):
+        """Draw everything again next time."""
+        self.viewport = None
+
+    def changed(self, layers):
+        """Return whether any of the layers changed since the surface was drawn."""
+        return self.versions != [layer.version for layer in layers]
+
+    def update(self, tilemap, layers):
+        """
+        Bring the surface up to date for the layers (some of the tilemap's)
+        at the tilemap's viewport, and return it.  The layers are drawn with
+        tilemap.draw_layer, so its profiler sees them.
+        """
+        viewport = tilemap.viewport
+        x, y, w, h = viewport
+        surface = self.surface
+        if (self.viewport is None or self.layers != layers or self.changed(layers)
+                or (w, h) != surface.get_size()):
+            self._redraw(tilemap, layers)
+            return self.surface
+
+        dx = x - self.viewport[0]
+        dy = y - self.viewport[1]
+        if not dx and not dy:
+            return surface
+        if abs(dx) >= w or abs(dy) >= h:
+            self._redraw(tilemap, layers)
+            return surface
+
+        surface.scroll(-dx, -dy)
+        strips = []
+        if dx > 0:
+            strips.append(pygame.Rect(w - dx, 0, dx, h))
+        elif dx < 0:
+            strips.append(pygame.Rect(0, 0, -dx, h))
+        if dy > 0:
+            strips.append(pygame.Rect(0, h - dy, w, dy))
+        elif dy < 0:
+            strips.append(pygame.Rect(0, 0, w, -dy))
+        for strip in strips:
+            surface.fill((0, 0, 0, 0), strip)
+            for layer in layers:
+                tilemap.draw_layer(layer, surface, strip)
+        self.viewport = tuple(viewport)
+        return surface
+
+    def _redraw(self, tilemap, layers):
+        x, y, w, h = tilemap.viewport
+        if (w, h) != self.surface.get_size():
+            self.surface = pygame.Surface((w, h), pygame.SRCALPHA).convert_alpha()
+        self.surface.fill((0, 0, 0, 0))
+        for layer in layers:
+            tilemap.draw_layer(layer, self.surface)
+        self.layers = layers
+        self.versions = [layer.version for layer in layers]
+        self.viewport = tuple(tilemap.viewport)
+
+
+class Renderer(object):
+    """
+    Draws everything, every frame.
+
+    Args
+        screen: the display surface.
+        background: the surface drawn behind the map; it doesn't scroll.
+
+    Each frame, call draw(tilemap), then mark(rect) for anything else drawn
+    on the screen, then present().
+    """
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.background = background
+
+    def draw(self, tilemap):
+        self.screen.blit(self.background, (0, 0))
+        tilemap.draw(self.screen)
+
+    def mark(self, rect):
+        """Note that something besides the map was drawn in rect."""
+        pass
+
+    def invalidate(self):
+        """
+        Forget anything cached about the static layers.  Changing tiles
+        doesn't need it: the layers' versions give that away.
+        """
+        pass
+
+    def present(self):
+        pygame.display.flip()
+
+
+class ScrollRenderer(Renderer):
+    """
+    Draws the static layers from a StaticLayers surface that's scrolled with
+    the camera, instead of drawing them from scratch every frame.
+
+    The background doesn't move with the camera, so it can't be scrolled
+    with the layers; it's still blitted every frame, under the layers.
+    If a static layer is above a sprite layer, every frame is drawn the way
+    Renderer does it.
+
+    Like TileMap.draw, the layers are timed by the tilemap's profiler (if
+    it has one), which also times bringing the scrolled surface up to date
+    as 'static layers'.
+    """
+    def __init__(self, screen, background):
+        super(ScrollRenderer, self).__init__(screen, background)
+        self.static = StaticLayers(screen.get_size())
+
+    def invalidate(self):
+        self.static.invalidate()
+
+    def draw(self, tilemap):
+        static, dynamic = split_layers(tilemap)
+        if static is None:
+            return super(ScrollRenderer, self).draw(tilemap)
+        self.screen.blit(self.background, (0, 0))
+        self.screen.blit(self._update_static(tilemap, static), (0, 0))
+        for layer in dynamic:
+            tilemap.draw_layer(layer, self.screen)
+
+    def _update_static(self, tilemap, static):
+        profiler = tilemap.profiler
+        if profiler is None:
+            profiler = NULL_PROFILER
+        with profiler.stage('static layers'):
+            return self.static.update(tilemap, static)
+
+
+class DirtyRectRenderer(ScrollRenderer):
+    """
+    Only redraws what changed while the camera isn't moving.
+
+    The background with the static layers on it is kept as a composite
+    surface.  While the viewport stays where it was, each frame just copies
+    the composite over what sprites and marked rects covered last frame,
+    draws the sprite layers again, and updates only those rects on the
+    display.  Whenever the viewport moves or a static layer changes, the
+    composite is rebuilt from the background and the scrolled static
+    layers, and the whole screen is redrawn and flipped.
+
+    If a static layer is above a sprite layer, the composite can't be used
+    and every frame is drawn in full.
+    """
+    def __init__(self, screen, background):
+        super(DirtyRectRenderer, self).__init__(screen, background)
+        self.composite = None
+        # the viewport the composite was drawn at
+        self._viewport = None
+        # rects drawn on last frame, which have to be restored this frame
+        self._previous = []
+        # rects to update on the display, or None to update everything
+        self._dirty = None
+        self._drawn = []
+
+    def invalidate(self):
+        super(DirtyRectRenderer, self).invalidate()
+        self.composite = None
+
+    def draw(self, tilemap):
+        static, dynamic = split_layers(tilemap)
+        if static is None:
+            Renderer.draw(self, tilemap)
+            self._dirty = None
+            self._drawn = []
+            return
+
+        viewport = tuple(tilemap.viewport)
+        if (self.composite is None or viewport != self._viewport
+                or self.static.changed(static)):
+            self._draw_composite(tilemap, static)
+            self._viewport = viewport
+            self.screen.blit(self.composite, (0, 0))
+            self._dirty = None
+        else:
+            self._dirty = self._previous
+            for rect in self._previous:
+                self.screen.blit(self.composite, rect, rect)
+
+        self._drawn = []
+        for layer in dynamic:
+            tilemap.draw_layer(layer, self.screen)
+            self._drawn.extend(layer.drawn)
+
+    def _draw_composite(self, tilemap, static):
+        if self.composite is None or self.composite.get_size() != self.screen.get_size():
+            self.composite = self.screen.copy()
+        self.composite.blit(self.background, (0, 0))
+        self.composite.blit(self._update_static(tilemap, static), (0, 0))
+
+    def mark(self, rect):
+        if rect is not None:
+            self._drawn.append(rect)
+
+    def present(self):
+        if self._dirty is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._dirty + self._drawn)
+        self._previous = self._drawn
@@ -1,8 +1,8 @@
 import os
 
 from .base import BaseSprite
-from .objects import Bullet
+from .objects import Bullet, BulletPool
 from .players import Player
-from .enemies import Enemy
-
-__all__ = ['BaseSprite', 'Bullet', 'Player', 'Enemy']
+from .enemies import Enemy, EnemyLayer
+
+__all__ = ['BaseSprite', 'Bullet', 'BulletPool', 'Player', 'Enemy', 'EnemyLayer']
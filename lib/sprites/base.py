@@ -3,6 +3,8 @@ import pygame
 
 import re
 
+from .. import collision
+
 SUPPORTED_IMAGE_FORMATS = '((gif)|(png))'
 WALK_IMAGE_FILE_PATTERN = re.compile(r'walk-[0-9][0-9]\.' + SUPPORTED_IMAGE_FORMATS)
 JUMP_IMAGE_FILE_PATTERN = re.compile(r'jump-[0-9][0-9]\.' + SUPPORTED_IMAGE_FORMATS)
@@ -57,21 +59,25 @@ class BaseSprite(pygame.sprite.Sprite):
 
     def react_to_blockers(self, dt, game, last_position, new):
         """React to any blockers that are nearby."""
-        for cell in game.tilemap.layers['triggers'].collide(new, 'blockers'):
-            blockers = cell['blockers']
-            if 'l' in blockers and last_position.right <= cell.left and new.right > cell.left:
+        self.resolve_blockers(game.blockers.collide(new), dt, game, last_position, new)
+
+    def resolve_blockers(self, blockers, dt, game, last_position, new):
+        """Keep new from moving through the given Blockers, in order."""
+        for cell in blockers:
+            sides = cell.sides
+            if sides & collision.LEFT and last_position.right <= cell.left and new.right > cell.left:
                 # this check is important because it lets you walk along blocks.
                 if not last_position.bottom == cell.top:
                     new.right = cell.left
                     if self.REVERSED_BY_BLOCKERS:
                         self.direction *=-1
-            if 'r' in blockers and last_position.left >= cell.right and new.left < cell.right:
+            if sides & collision.RIGHT and last_position.left >= cell.right and new.left < cell.right:
                 # this check is important because it lets you walk along blocks.
                 if not last_position.bottom == cell.top:
                     new.left = cell.right
                     if self.REVERSED_BY_BLOCKERS:
                         self.direction *=-1
-            if 't' in blockers and last_position.bottom <= cell.top and new.bottom > cell.top:
+            if sides & collision.TOP and last_position.bottom <= cell.top and new.bottom > cell.top:
                 # this check makes sure you can't cling to blocks that you shouldn't be able to.
                 if new.right > cell.left and new.left < cell.right:
                     self.resting = True
@@ -79,7 +85,7 @@ class BaseSprite(pygame.sprite.Sprite):
                     new.bottom = cell.top
                     if self.AFFECTED_BY_GRAVITY:
                         self.dy = game.GRAVITY * dt
-            if 'b' in blockers and last_position.top >= cell.bottom and new.top < cell.bottom:
+            if sides & collision.BOTTOM and last_position.top >= cell.bottom and new.top < cell.bottom:
                 # this check makes sure you can't cling to blocks that you shouldn't be able to.
                 if new.right > cell.left and new.left < cell.right:
                     new.top = cell.bottom
@@ -87,6 +93,74 @@ class BaseSprite(pygame.sprite.Sprite):
                         self.dy = 0
 
 
+    def first_impact(self, blockers, last_position, new):
+        """
+        Return (time, side, blocker) for the first of the Blockers that the
+        move from last_position to new passed all the way across, or None.
+        time is the fraction of the move made before the impact.
+        """
+        dx = new.x - last_position.x
+        dy = new.y - last_position.y
+        first = None
+        for cell in blockers:
+            sides = cell.sides
+            impacts = []
+            if sides & collision.LEFT and dx > 0 and last_position.right <= cell.left and new.left > cell.right:
+                impacts.append(((cell.left - last_position.right) / dx, collision.LEFT))
+            if sides & collision.RIGHT and dx < 0 and last_position.left >= cell.right and new.right < cell.left:
+                impacts.append(((last_position.left - cell.right) / -dx, collision.RIGHT))
+            if sides & collision.TOP and dy > 0 and last_position.bottom <= cell.top and new.top > cell.bottom:
+                impacts.append(((cell.top - last_position.bottom) / dy, collision.TOP))
+            if sides & collision.BOTTOM and dy < 0 and last_position.top >= cell.bottom and new.bottom < cell.top:
+                impacts.append(((last_position.top - cell.bottom) / -dy, collision.BOTTOM))
+            for time, side in impacts:
+                if first is not None and time >= first[0]:
+                    continue
+                # the sprite has to overlap the side it's crossing when it crosses it.
+                left = last_position.left + dx * time
+                top = last_position.top + dy * time
+                if side in (collision.LEFT, collision.RIGHT):
+                    overlaps = top < cell.bottom and top + new.height > cell.top
+                else:
+                    overlaps = left < cell.right and left + new.width > cell.left
+                if overlaps:
+                    first = (time, side, cell)
+        return first
+
+    def sweep_blockers(self, dt, game, last_position, new):
+        """
+        Stop new at any blockers the sprite moved clean through.
+
+        Blockers are only checked against where the sprite ends up, so one
+        that moves farther than its own size in a step (falling fast, or on
+        a long frame) could skip over a blocker.  This finds the earliest
+        blocker along the way that it would have hit and stops it there,
+        the same way react_to_blockers would have, and then looks again
+        for the rest of the move.
+        """
+        for _ in range(2):
+            impact = self.first_impact(game.blockers.collide(last_position.union(new)),
+                                       last_position, new)
+            if impact is None:
+                return
+            time, side, cell = impact
+            if side == collision.LEFT:
+                new.right = cell.left
+            elif side == collision.RIGHT:
+                new.left = cell.right
+            elif side == collision.TOP:
+                self.resting = True
+                self.double_jumped = False
+                new.bottom = cell.top
+                if self.AFFECTED_BY_GRAVITY:
+                    self.dy = game.GRAVITY * dt
+            else:
+                new.top = cell.bottom
+                if self.AFFECTED_BY_GRAVITY:
+                    self.dy = 0
+            if side in (collision.LEFT, collision.RIGHT) and self.REVERSED_BY_BLOCKERS:
+                self.direction *= -1
+
     def move_x(self, dt):
         """Move in the x direction."""
         return self.direction * self.SPEED * self.moving * self.x_multiplier * dt
@@ -102,6 +176,8 @@ class BaseSprite(pygame.sprite.Sprite):
         new = self.rect
         self.resting = False
         if self.AFFECTED_BY_BLOCKERS:
+            if abs(new.x - last_position.x) > new.width or abs(new.y - last_position.y) > new.height:
+                self.sweep_blockers(dt, game, last_position, new)
             self.react_to_blockers(dt, game, last_position, new)
 
         return new
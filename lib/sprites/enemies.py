@@ -1,14 +1,22 @@
 """Enemy classes"""
 
 from __future__ import division
+import functools
 import os
 import re
 # third-party imports
 import pygame
+try:
+    import numpy
+except ImportError:
+    # EnemyLayer just updates its enemies one at a time.
+    numpy = None
 
 # first-party imports
 from .base import BaseSprite, WALK_IMAGE_FILE_PATTERN
+from .. import collision
 from .. import pyganim
+from .. import tmx
 
 ENEMIES = os.path.join('images', 'sprites', 'enemies')
 
@@ -18,26 +26,51 @@ class Enemy(BaseSprite):
     attack = 1
     REVERSED_BY_BLOCKERS = True
 
-    def _get_image_files(self, character):
-        """Return a tuple of the form (walk_files), (jump_files), weapon_file"""
+    @classmethod
+    @functools.lru_cache()
+    def _get_image_files(cls, character):
+        """
+        Return a tuple of the walk files.  The files are only looked up once
+        for each character.
+        """
         p = os.path.join(ENEMIES, character)
         files = os.listdir(p)
 
         def filter_files(pattern):
             filter_function = lambda file:re.match(pattern, file)
-            filtered_files = [os.path.join(p, i) for i in filter(filter_function, files)]
+            filtered_files = tuple(os.path.join(p, i) for i in filter(filter_function, files))
             return filtered_files
 
         walk_files = filter_files(WALK_IMAGE_FILE_PATTERN)
 
         return walk_files
 
+    @classmethod
+    def image_keys(cls, enemy):
+        """
+        Return the images an Enemy of this type loads, as (image_path, kwargs)
+        pairs of the `images.load` calls for them.
+        """
+        keys = []
+        for image in cls._get_image_files(enemy):
+            keys.append((image, {'convert': False}))
+            keys.append((image, {'convert': False, 'flip': (True, False)}))
+        return keys
 
 
+    @classmethod
+    def clips(cls, enemy):
+        """
+        Return the (walk left, walk right) pyganim.Clips for this type of
+        enemy, which every enemy of the type shares.
+        """
+        walk_left = pyganim.getClip([(image, .15) for image in cls._get_image_files(enemy)], convert=False)
+        return walk_left, walk_left.flip(True, False)
+
     def init_animations(self, enemy):
-        images = self._get_image_files(enemy)
-        self.anim_walk_left = pyganim.PygAnimation([(image, .15) for image in images], convert=False)
-        self.anim_walk_right = pyganim.PygAnimation([(image, .15) for image in images], convert=False, flip=(True, False))
+        walk_left, walk_right = self.clips(enemy)
+        self.anim_walk_left = walk_left.playhead()
+        self.anim_walk_right = walk_right.playhead()
 
         self.image = self.anim_walk_left.getCurrentFrame()
 
@@ -58,20 +91,190 @@ class Enemy(BaseSprite):
             self.image = self.anim_walk_right.getCurrentFrame()
             self.anim_walk_left.stop()
 
+    def reverse(self, cell):
+        """Turn around at the reverse trigger cell."""
+        if self.direction > 0:
+            self.rect.right = cell.left
+        else:
+            self.rect.left = cell.right
+        self.direction *= -1
+
+    def hit_players(self, game):
+        """Hurt any player the enemy collides with."""
+        for player in game.players:
+            if not player.invincible and self.rect.colliderect(player.rect):
+                self.hit(player)
+
     def update(self, dt, game):
         self.move(dt, game)
         for cell in game.tilemap.layers['triggers'].collide(self.rect, 'reverse'):
-            if self.direction > 0:
-                self.rect.right = cell.left
-            else:
-                self.rect.left = cell.right
-            self.direction *= -1
+            self.reverse(cell)
             break
 
         self.set_image()
 
         # kill any player the enemy collides with.
+        self.hit_players(game)
+
+
+def round_like_rect(values):
+    """
+    Round an array of floats the way a pygame Rect rounds a float assigned to
+    it: to the nearest integer, with halves away from zero.
+    """
+    whole = numpy.trunc(values)
+    halves = numpy.abs(values - whole) >= .5
+    return (whole + numpy.where(halves, numpy.sign(values), 0)).astype(int)
+
+
+def overlapping(rects, cells):
+    """
+    Return an array of which of the cells (an array of left, top, right,
+    bottom rows) each of the rects (the same) touches, the way
+    ObjectLayer.collide tests them.
+    """
+    return ((rects[:, 2, None] >= cells[:, 0]) & (rects[:, 3, None] >= cells[:, 1]) &
+            (rects[:, 0, None] <= cells[:, 2]) & (rects[:, 1, None] <= cells[:, 3]))
+
+
+class EnemyLayer(tmx.SpriteLayer):
+    """
+    A SpriteLayer that moves all of its Enemies in one go.
+
+    With NumPy, every update gathers the enemies' positions, fall speeds and
+    walking speeds into arrays, applies gravity and walking to all of them
+    at once, and tests them against arrays of the blocker and reverse
+    trigger rects instead of querying the triggers layer for each enemy.
+    Only the enemies that touch a blocker, a reverser or a player are then
+    handled one at a time, in layer order and with the same code Enemy.update
+    uses, so the enemies end up exactly where Enemy.update would put them.
+
+    Without NumPy, or when any sprite on the layer moves differently from a
+    plain Enemy, each sprite's update() is called as usual.  Set batched to
+    False to always do that.
+
+    collide(rect) finds the enemies a rect collides with (a bullet, say)
+    through a collision.SweepAndPrune, which sorts them at most once between
+    updates, instead of checking every enemy for every query.
+    """
+    batched = numpy is not None
+
+    def __init__(self, name='enemies'):
+        super(EnemyLayer, self).__init__(name)
+        # propname -> (cache key, cells, array of cell rects)
+        self._cells = {}
+        self._blockers = (None, None)
+        self.broad_phase = collision.SweepAndPrune(self)
+
+    def add_internal(self, sprite, layer=None):
+        super(EnemyLayer, self).add_internal(sprite, layer)
+        self.broad_phase.invalidate()
+
+    def collide(self, rect):
+        """Return the enemies that collide with rect, in layer order."""
+        return self.broad_phase.collide(rect)
+
+    @staticmethod
+    def batchable(cls):
+        """Return whether sprites of class cls can be moved in a batch."""
+        return (issubclass(cls, Enemy) and cls.update is Enemy.update and
+                cls.move is BaseSprite.move and cls.move_x is BaseSprite.move_x and
+                cls.react_to_gravity is BaseSprite.react_to_gravity and
+                cls.react_to_blockers is BaseSprite.react_to_blockers and
+                cls.AFFECTED_BY_GRAVITY and cls.AFFECTED_BY_BLOCKERS)
+
+    def trigger_cells(self, triggers, propname):
+        """
+        Return the trigger cells with propname set, in layer order, and an
+        array of their left, top, right, bottom edges.
+        """
+        key = (triggers, triggers.version, len(triggers.objects))
+        cached = self._cells.get(propname)
+        if cached is None or cached[0] != key:
+            cells = triggers.find(propname)
+            edges = numpy.array([(c.left, c.top, c.right, c.bottom) for c in cells],
+                                dtype=float).reshape(-1, 4)
+            cached = self._cells[propname] = (key, cells, edges)
+        return cached[1], cached[2]
+
+    def blocker_edges(self, grid):
+        """Return an array of the left, top, right, bottom edges of grid's Blockers."""
+        key = (grid, grid.refresh().version)
+        if self._blockers[0] != key:
+            edges = numpy.array([blocker[1:5] for blocker in grid.blockers],
+                                dtype=float).reshape(-1, 4)
+            self._blockers = (key, edges)
+        return self._blockers[1]
+
+    def update(self, dt, game, *args):
+        enemies = self.sprites()
+        if (self.batched and enemies and
+                all(self.batchable(cls) for cls in set(map(type, enemies)))):
+            self.update_batch(dt, game, enemies)
+        else:
+            super(EnemyLayer, self).update(dt, game, *args)
+        # the enemies have moved.
+        self.broad_phase.invalidate()
+
+    def update_batch(self, dt, game, enemies):
+        """Do what Enemy.update does for all of the enemies."""
+        triggers = game.tilemap.layers['triggers']
+        rects = [enemy.rect for enemy in enemies]
+        state = numpy.array([(r.x, r.y, r.width, r.height, enemy.dy, enemy.MAX_FALL_SPEED,
+                              enemy.direction * enemy.SPEED * enemy.moving * enemy.x_multiplier)
+                             for r, enemy in zip(rects, enemies)], dtype=float)
+        x, y, width, height, dy, max_fall, speed = state.T
+
+        # BaseSprite.move for every enemy at once.
+        dy = numpy.minimum(max_fall, dy + game.GRAVITY * dt)
+        new_y = round_like_rect(y + dy * dt)
+        new_x = x.astype(int) + numpy.trunc(speed * dt).astype(int)
+
+        edges = self.blocker_edges(game.blockers)
+        cells = game.blockers.blockers
+        moved = numpy.column_stack((new_x, new_y, new_x + width, new_y + height))
+        touching = overlapping(moved, edges)
+        blocking = [[] for enemy in enemies]
+        for i, j in zip(*(index.tolist() for index in touching.nonzero())):
+            blocking[i].append(cells[j])
+        # enemies that moved farther than their size have to be swept.
+        fast = ((numpy.abs(new_x - x) > width) | (numpy.abs(new_y - y) > height)).tolist()
+        xs, ys = new_x.tolist(), new_y.tolist()
+        for i, (enemy, rect, fall) in enumerate(zip(enemies, rects, dy.tolist())):
+            last_position = rect.copy()
+            rect.topleft = xs[i], ys[i]
+            # min() keeps MAX_FALL_SPEED itself once it's reached, like react_to_gravity.
+            enemy.dy = min(enemy.MAX_FALL_SPEED, fall)
+            enemy.resting = False
+            if fast[i]:
+                enemy.sweep_blockers(dt, game, last_position, rect)
+                enemy.react_to_blockers(dt, game, last_position, rect)
+                xs[i], ys[i] = rect.topleft
+            elif blocking[i]:
+                enemy.resolve_blockers(blocking[i], dt, game, last_position, rect)
+                xs[i], ys[i] = rect.topleft
+
+        # turn around at the first reverser each enemy touches.
+        cells, edges = self.trigger_cells(triggers, 'reverse')
+        if len(cells):
+            new_x, new_y = numpy.array(xs), numpy.array(ys)
+            moved = numpy.column_stack((new_x, new_y, new_x + width, new_y + height))
+            touching = overlapping(moved, edges)
+            for i in numpy.flatnonzero(touching.any(axis=1)):
+                enemies[i].reverse(cells[touching[i].argmax()])
+                xs[i] = rects[i].x
+
+        for enemy in enemies:
+            enemy.set_image()
+
+        # only the enemies that overlap a player can hit one.
+        new_x, new_y = numpy.array(xs), numpy.array(ys)
+        near = numpy.zeros(len(enemies), dtype=bool)
         for player in game.players:
-            if not player.invincible and self.rect.colliderect(player.rect):
-                self.hit(player)
+            if not player.invincible:
+                px, py, pw, ph = player.rect
+                near |= ((new_x < px + pw) & (new_x + width > px) &
+                         (new_y < py + ph) & (new_y + height > py))
+        for i in numpy.flatnonzero(near):
+            enemies[i].hit_players(game)
 
@@ -13,32 +13,57 @@ class Bullet(BaseSprite):
 
     def __init__(self, location, direction, image_path, *groups):
         super(Bullet, self).__init__(*groups)
-        self.image_left = images.load(image_path, convert=False)
-        self.image_right = images.load(image_path, flip=(True, False), convert=False)
+        # the BulletPool this bullet goes back to when it's done, if any.
+        self.pool = None
+        self.image_path = None
+        self.rect = pygame.rect.Rect(0, 0, 0, 0)
+        self.reset(location, direction, image_path)
+
+    def reset(self, location, direction, image_path):
+        """Set the bullet up to be fired from location in direction."""
+        if image_path != self.image_path:
+            self.image_path = image_path
+            self.image_left = images.load(image_path, convert=False)
+            self.image_right = images.load(image_path, flip=(True, False), convert=False)
 
         if direction == self.RIGHT:
             self.image = self.image_right
-            self.rect = pygame.rect.Rect(location, self.image.get_size())
-
+            self.rect.topleft = location
         else:
             self.image = self.image_left
-            x_ = self.image.get_size()[0]
-            self.rect = pygame.rect.Rect((location[0] - x_, location[1]), self.image.get_size())
+            self.rect.topleft = (location[0] - self.image.get_width(), location[1])
+        self.rect.size = self.image.get_size()
         self.direction = direction
         self.lifespan = self.LIFESPAN
+        # don't draw a recycled bullet moving from where it was last time.
+        self.previous_position = None
+
+    def expire(self):
+        """Take the bullet out of the game, back to its pool if it has one."""
+        if self.pool is None:
+            self.kill()
+        else:
+            self.pool.release(self)
 
     def update(self, dt, game):
         self.lifespan -= dt
         if self.lifespan < 0:
-            self.kill()
+            self.expire()
             return
+        last_position = self.rect.copy()
         self.move(dt, game)
 
+        hit_box = self.rect
+        if abs(self.rect.x - last_position.x) > self.rect.width:
+            # the bullet moved far enough to jump over an enemy, so check
+            # everything it passed on the way.
+            hit_box = self.rect.union(last_position)
+
         # get all collided sprites, to kill only the nearest one.
-        collided = pygame.sprite.spritecollide(self, game.enemies, False)
+        collided = game.enemies.collide(hit_box)
         if collided:
             self.kill_nearest(collided)
-            self.kill()
+            self.expire()
 
     def kill_nearest(self, sprites):
         """Kill the nearest sprite in sprites."""
@@ -49,3 +74,56 @@ class Bullet(BaseSprite):
             sprites[-1].kill()
 
 
+class BulletPool(object):
+    """
+    Recycles Bullets, so firing doesn't make a new sprite every shot.
+
+    Args
+        group: the sprite group (layer) fired bullets are added to.
+        cap: the most spent bullets to keep for reuse.
+        bullet_class: the kind of bullet to make.
+
+    Attributes
+        hits: how many shots reused a spent bullet.
+        allocations: how many shots had to make a new one.
+        dropped: how many spent bullets didn't fit under the cap.
+    """
+    CAP = 32
+
+    def __init__(self, group, cap=CAP, bullet_class=Bullet):
+        self.group = group
+        self.cap = cap
+        self.bullet_class = bullet_class
+        self.free = []
+        self.hits = 0
+        self.allocations = 0
+        self.dropped = 0
+
+    def fire(self, location, direction, image_path):
+        """Put a bullet into the game at location, going in direction."""
+        if self.free:
+            bullet = self.free.pop()
+            bullet.reset(location, direction, image_path)
+            bullet.add(self.group)
+            self.hits += 1
+        else:
+            bullet = self.bullet_class(location, direction, image_path, self.group)
+            bullet.pool = self
+            self.allocations += 1
+        return bullet
+
+    def release(self, bullet):
+        """Take bullet out of the game and keep it for the next shot."""
+        bullet.kill()
+        if len(self.free) < self.cap:
+            self.free.append(bullet)
+        else:
+            self.dropped += 1
+
+    def stats(self):
+        """Return a dict of the pool's numbers."""
+        return {'hits': self.hits,
+                'allocations': self.allocations,
+                'dropped': self.dropped,
+                'free': len(self.free),
+                'cap': self.cap}
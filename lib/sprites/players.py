@@ -2,6 +2,7 @@
 from __future__ import division
 
 # first-party imports
+import functools
 import glob
 import os
 import re
@@ -12,7 +13,6 @@ import pygame
 # first-party imports
 from .base import BaseSprite
 from .base import WALK_IMAGE_FILE_PATTERN, JUMP_IMAGE_FILE_PATTERN, WEAPON_FILE_PATTERN, STILL_FILE_PATTERN
-from .objects import Bullet
 from .. import images
 from .. import pyganim
 
@@ -47,14 +47,19 @@ class Player(BaseSprite):
     MAX_HEALTH = 5
 
 
-    def _get_image_files(self, character):
-        """Return a tuple of the form (walk_files), (jump_files), weapon_file"""
+    @classmethod
+    @functools.lru_cache()
+    def _get_image_files(cls, character):
+        """
+        Return a tuple of the form (walk_files), (jump_files), weapon_file,
+        still_file.  The files are only looked up once for each character.
+        """
         p = os.path.join(DEFAULT_PLAYERS, character)
         files = os.listdir(p)
 
         def filter_files(pattern):
             filter_function = lambda file:re.match(pattern, file)
-            filtered_files = [os.path.join(p, i) for i in filter(filter_function, files)]
+            filtered_files = tuple(os.path.join(p, i) for i in filter(filter_function, files))
             return filtered_files
 
         walk_files = filter_files(WALK_IMAGE_FILE_PATTERN)
@@ -67,19 +72,39 @@ class Player(BaseSprite):
 
         return walk_files, jump_files, weapon_file, still_file
 
+    @classmethod
+    def image_keys(cls, character):
+        """
+        Return the images a Player with this character loads, as
+        (image_path, kwargs) pairs of the `images.load` calls for them.
+        """
+        walk_files, jump_files, weapon_file, still_file = cls._get_image_files(character)
+        keys = []
+        for image in walk_files + jump_files:
+            keys.append((image, {}))
+            keys.append((image, {'convert': False, 'flip': (True, False)}))
+        for image in (still_file, weapon_file):
+            keys.append((image, {'convert': False}))
+            keys.append((image, {'convert': False, 'flip': (True, False)}))
+        return keys
+
     def init_animations(self, character):
         # folder containing the character images.
 
         walk_anim_files, jump_anim_files, weapon_file, still_file = self._get_image_files(character)
 
-        self.anim_walk_left = pyganim.PygAnimation([(image, .1) for image in walk_anim_files])
-        self.anim_walk_right = pyganim.PygAnimation([(image, .1) for image in walk_anim_files], convert=False, flip=(True, False))
+        # the animations are shared by every player with this character;
+        # each player just has its own playheads for them.
+        walk_left = pyganim.getClip([(image, .1) for image in walk_anim_files])
+        self.anim_walk_left = walk_left.playhead()
+        self.anim_walk_right = walk_left.flip(True, False).playhead()
 
         self.image_face_left = images.load(still_file, convert=False)
         self.image_face_right = images.load(still_file, flip=(True, False), convert=False)
 
-        self.anim_jump_left = pyganim.PygAnimation([(image, .1) for image in jump_anim_files])
-        self.anim_jump_right = pyganim.PygAnimation([(image, .1) for image in jump_anim_files], convert=False, flip=(True,False))
+        jump_left = pyganim.getClip([(image, .1) for image in jump_anim_files])
+        self.anim_jump_left = jump_left.playhead()
+        self.anim_jump_right = jump_left.flip(True, False).playhead()
 
         self.weapon = weapon_file
 
@@ -180,7 +205,7 @@ class Player(BaseSprite):
         if self.shoot:
             if not self.gun_cooldown:
                 game.shoot.play()
-                Bullet(self.rect.center, self.direction, self.weapon, game.sprites)
+                game.bullet_pool.fire(self.rect.center, self.direction, self.weapon)
                 self.gun_cooldown = self.COOLDOWN_TIME
             self.shoot = False
 
@@ -6,9 +6,15 @@
 # Ported to Python 3
 # Added selective area support SpriteLayer.draw
 from __future__ import division
+from array import array
+from collections import OrderedDict
 from os import path
-import sys
+import hashlib
+import marshal
+import mmap
+import os
 import struct
+import sys
 import pygame
 from pygame import Rect
 from xml.etree import ElementTree
@@ -22,6 +28,28 @@ FLIPPED_HORIZONTALLY_FLAG = 0x80000000
 FLIPPED_VERTICALLY_FLAG   = 0x40000000
 FLIPPED_DIAGONALLY_FLAG   = 0x20000000
 GID_PART                  = 0X0FFFFFFF
+
+# Size (in pixels) of the square buckets ObjectLayers file their objects in.
+OBJECT_BUCKET_SIZE = 128
+
+# Size (in pixels) of the square chunks Layers pre-render their tiles into,
+# and how many chunks a Layer keeps around before evicting the least
+# recently drawn one.
+LAYER_CHUNK_SIZE = 512
+LAYER_MAX_CHUNKS = 32
+
+# The function Tilesets load their image files with.  A game can make this
+# its own image cache, so that images it has already decoded are used.
+load_image = pygame.image.load
+
+# Compiled map caches are stored next to the .tmx file with this suffix.
+# The header is: magic, format version, size and mtime (in ns) of the .tmx
+# file, sha1 of the .tmx file, and the length of the marshalled metadata.
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'TMXC'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sIQq20sI')
+
 class Tile(object):
     """
     Every tile in the Tileset class is an instance of this class.
@@ -93,6 +121,8 @@ class Tileset(object):
         self.firstgid = firstgid
         self.tiles = []
         self.properties = {}
+        # paths of the images added with add_image().
+        self.images = []
 
     @classmethod
     def fromxml(cls, tag, xml_filename, firstgid=None):
@@ -121,7 +151,7 @@ class Tileset(object):
 
         tileset = cls(name, tile_width, tile_height, firstgid)
 
-        for c in tag.getchildren():
+        for c in tag:
             if c.tag == "image":
                 # create a tileset
                 image = path.join(path.dirname(xml_filename),c.attrib['source'])
@@ -139,9 +169,10 @@ class Tileset(object):
         Args
             file: path to tilseet image.
         """
-        image = pygame.image.load(file).convert_alpha()
+        image = load_image(file).convert_alpha()
         if not image:
             sys.exit("Error creating new Tileset: file {} not found".format(file))
+        self.images.append(file)
         id_ = self.firstgid
 
         # set up all the individual tiles in the tileset.
@@ -160,10 +191,28 @@ class Tileset(object):
 
 class Tilesets(dict):
     """
-    All tiles go into the Tilesets class.  Then you go like this:
+    All tiles go into the Tilesets class, keyed off gid.  Then you go like this:
 
+        tile = tilemap.tilesets[gid]
 
+    A gid with any of the FLIPPED_* flags set gets its flipped Tile made from
+    the plain tile the first time it's looked up.  The flipped Tile is kept
+    under the full gid, so every cell using that tile and flip combination
+    shares one transformed surface.  variants_created counts how many
+    flipped Tiles have been made.
     """
+    def __init__(self, *args, **kwargs):
+        super(Tilesets, self).__init__(*args, **kwargs)
+        self.variants_created = 0
+
+    def __missing__(self, gid):
+        if gid & ~GID_PART and (gid & GID_PART) in self:
+            tile = make_flipped_tile(self, gid)
+            self[gid] = tile
+            self.variants_created += 1
+            return tile
+        raise KeyError(gid)
+
     def add(self, tileset):
         for i, tile in enumerate(tileset.tiles):
             i += tileset.firstgid
@@ -239,6 +288,156 @@ class Cell(object):
         return True
 
 
+def make_flipped_tile(tilesets, gid):
+    '''Return a new Tile for a gid that has any of the FLIPPED_* flags set,
+    with the flips applied to the surface of the plain tile.
+
+    Tilesets calls this for you the first time a flipped gid is looked up.
+    '''
+    flipped_horizontally = gid & FLIPPED_HORIZONTALLY_FLAG
+    flipped_vertically = gid & FLIPPED_VERTICALLY_FLAG
+    flipped_diagonally = gid & FLIPPED_DIAGONALLY_FLAG
+    tile_gid = gid & GID_PART
+
+    # get a copy of the surface in order to do transformations on it.
+    new_surface = tilesets[tile_gid].surface
+
+    if flipped_diagonally:
+        new_surface = pygame.transform.rotate(new_surface, 270)
+        new_surface = pygame.transform.flip(new_surface, True, False)
+    if flipped_horizontally:
+        new_surface = pygame.transform.flip(new_surface, True, False)
+    if flipped_vertically:
+        new_surface = pygame.transform.flip(new_surface, False, True)
+
+    return Tile(gid, new_surface, tilesets[tile_gid].tileset)
+
+
+class CellGrid(object):
+    '''The cells of a Layer, stored as a flat row-major array of gids.
+
+    This acts like a dict of Cell instances keyed off (x, y) index, but a
+    Cell is only created the first time it's looked up.  After that the same
+    Cell is returned every time, so properties set on it stick around.
+
+    gids - an array('I') of width * height gids; 0 means the cell is empty.
+    '''
+    def __init__(self, width, height, tile_width, tile_height, tilesets,
+            gids=None):
+        self.width, self.height = width, height
+        self.tile_width, self.tile_height = tile_width, tile_height
+        self.tilesets = tilesets
+        if gids is None:
+            gids = array('I', [0]) * (width * height)
+        assert len(gids) == width * height
+        self.gids = gids
+        # the Cell instances that have been created so far.
+        self._cells = {}
+
+    def _index(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return None
+
+    def tile(self, gid):
+        '''Return the Tile for gid.
+        '''
+        return self.tilesets[gid]
+
+    def tile_at(self, x, y):
+        '''Return the Tile at index (x, y) without creating a Cell, or None
+        if the cell is empty.
+        '''
+        cell = self._cells.get((x, y))
+        if cell is not None:
+            return cell.tile
+        gid = self.gids[y * self.width + x]
+        if gid:
+            return self.tile(gid)
+        return None
+
+    def __contains__(self, pos):
+        if pos in self._cells:
+            return True
+        i = self._index(pos)
+        return i is not None and self.gids[i] != 0
+
+    def __getitem__(self, pos):
+        cell = self._cells.get(pos)
+        if cell is not None:
+            return cell
+        i = self._index(pos)
+        gid = self.gids[i] if i is not None else 0
+        if not gid:
+            raise KeyError(pos)
+        x, y = i % self.width, i // self.width
+        cell = Cell(x, y, x * self.tile_width, y * self.tile_height,
+                self.tile(gid))
+        self._cells[x, y] = cell
+        return cell
+
+    def get(self, pos, default=None):
+        try:
+            return self[pos]
+        except KeyError:
+            return default
+
+    def __setitem__(self, pos, cell):
+        self._cells[pos] = cell
+        i = self._index(pos)
+        if i is not None:
+            self.gids[i] = cell.tile.gid
+
+    def __delitem__(self, pos):
+        if pos not in self:
+            raise KeyError(pos)
+        self._cells.pop(pos, None)
+        i = self._index(pos)
+        if i is not None:
+            self.gids[i] = 0
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        width, cells = self.width, self._cells
+        for i, gid in enumerate(self.gids):
+            if gid or cells and (i % width, i // width) in cells:
+                yield i % width, i // width
+        for pos in list(cells):
+            if self._index(pos) is None:
+                yield pos
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[pos] for pos in self]
+
+    def items(self):
+        return [(pos, self[pos]) for pos in self]
+
+    def positions_with(self, propname):
+        '''Return the (x, y) indexes, in row order, of the cells that might
+        have propname set: the cells whose tile has it, and every Cell that
+        has been created (its own properties may have been changed).
+        '''
+        matching = set()
+        for gid in set(self.gids):
+            tile = self.tilesets.get(gid)
+            if tile is not None and propname in tile.properties:
+                matching.add(gid)
+        width = self.width
+        r = [(i % width, i // width) for i, gid in enumerate(self.gids)
+                if gid in matching]
+        found = set(r)
+        created = [pos for pos in self._cells if pos not in found]
+        if created:
+            r = sorted(r + created, key=lambda pos: (pos[1], pos[0]))
+        return r
+
+
 class LayerIterator(object):
     '''Iterates over all the cells in a layer in column,row order.
     '''
@@ -267,16 +466,30 @@ class Layer(object):
         px_width, px_height - the dimensions of the Layer in pixels
         tilesets - the tilesets used in this Layer (a Tilesets instance)
         properties - any properties set for this Layer
-        cells - a dict of all the Cell instances for this Layer, keyed off
-                (x, y) index.
+        cells - all the Cell instances for this Layer, keyed off (x, y)
+                index.  This is a CellGrid, which stores the layer as a
+                compact array of gids and only creates Cells on demand.
 
     Additionally you may look up a cell using direct item access:
 
        layer[x, y] is layer.cells[x, y]
 
     Note that empty cells will be set to None instead of a Cell instance.
+
+    Layers are drawn from chunk_size square surfaces with the tiles already
+    blitted on them.  Chunks are rendered the first time they come into view
+    and at most max_chunks of them are kept, least recently drawn first out.
+    Setting a cell through item access throws away the chunks it's on; if
+    a Cell's tile is changed some other way, call invalidate().  version
+    goes up every time chunks are thrown away, so anything else drawn from
+    the layer (the renderers' scrolled surfaces) can tell when it has to be
+    drawn again.
+
+    draw() returns the number of blits it made, and queries counts the calls
+    to collide(), for profiling.
     '''
-    def __init__(self, name, visible, level):
+    def __init__(self, name, visible, level, chunk_size=LAYER_CHUNK_SIZE,
+            max_chunks=LAYER_MAX_CHUNKS):
         self.name = name
         self.visible = visible
         self.position = (0, 0)
@@ -290,7 +503,16 @@ class Layer(object):
         self.tilesets = level.tilesets
         self.group = pygame.sprite.Group()
         self.properties = {}
-        self.cells = {}
+        self.cells = CellGrid(self.width, self.height, self.tile_width,
+                self.tile_height, self.tilesets)
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self._chunks = OrderedDict()
+        # how far (w, h) the biggest tiles stick out of their cells, worked
+        # out on the first draw; tiles are only drawn from chunks if none do.
+        self._overhang = None
+        self.queries = 0
+        self.version = 0
 
     def __repr__(self):
         return '<Layer "%s" at 0x%x>' % (self.name, id(self))
@@ -303,6 +525,10 @@ class Layer(object):
         px = x * self.tile_width
         py = y * self.tile_width
         self.cells[pos] = Cell(x, y, px, py, tile)
+        w, h = tile.surface.get_size()
+        if w > self.tile_width or h > self.tile_height:
+            self._overhang = None
+        self.invalidate(Rect(px, py, tile.tile_width, tile.tile_height))
 
     def __iter__(self):
         return LayerIterator(self)
@@ -319,38 +545,14 @@ class Layer(object):
         data = data.encode() # Convert to bytes
         # Decode from base 64 and decompress via zlib
         data = decompress(b64decode(data))
-        data = struct.unpack('<%dI' % (len(data)/4,), data)
-        assert len(data) == layer.width * layer.height
-        for i, gid in enumerate(data):
-            if gid < 1: continue   # not set
-            try:
-                tile = level.tilesets[gid]
-            except KeyError:
-                # TODO: turn this into a function
-                # we'll come in here for flipped/rotated tiles.  We need to
-                # add a new tile to the tilesets.
-                flipped_horizontally = gid & FLIPPED_HORIZONTALLY_FLAG
-                flipped_vertically = gid & FLIPPED_VERTICALLY_FLAG
-                flipped_diagonally = gid & FLIPPED_DIAGONALLY_FLAG
-                tile_gid = gid & GID_PART
-
-                # get a copy of the surface in order to do transformations on it.
-                new_surface = level.tilesets[tile_gid].surface
-
-                if flipped_diagonally:
-                    new_surface = pygame.transform.rotate(new_surface, 270)
-                    new_surface = pygame.transform.flip(new_surface, True, False)
-                if flipped_horizontally:
-                    new_surface = pygame.transform.flip(new_surface, True, False)
-                if flipped_vertically:
-                    new_surface = pygame.transform.flip(new_surface, False, True)
-
-                tile = Tile(gid, new_surface, level.tilesets[tile_gid].tileset)
-
-
-            x = i % layer.width
-            y = i // layer.width
-            layer.cells[x,y] = Cell(x, y, x*level.tile_width, y*level.tile_height, tile)
+        # the gids are stored as little-endian unsigned 32 bit integers.
+        gids = array('I')
+        assert gids.itemsize == 4
+        gids.frombytes(data)
+        if sys.byteorder == 'big':
+            gids.byteswap()
+        assert len(gids) == layer.width * layer.height
+        layer.cells.gids = gids
 
         return layer
 
@@ -364,27 +566,147 @@ class Layer(object):
         y -= viewport_oy
         self.position = (x, y)
 
-    def draw(self, surface):
+    def draw(self, surface, area=None):
         '''Draw this layer, limited to the current viewport, to the Surface.
+
+        If area (a Rect in surface coordinates) is given, only that part of
+        the viewport is drawn.
+        '''
+        if self._overhang is None:
+            self._overhang = self._tile_overhang()
+        if self._overhang != (0, 0):
+            return self.draw_tiles(surface, area)
+
+        ox, oy = self.position
+        if area is None:
+            left, top, width, height = 0, 0, self.view_w, self.view_h
+        else:
+            left, top, width, height = area
+            clip = surface.get_clip()
+            surface.set_clip(area)
+        size = self.chunk_size
+        blits = 0
+        for cx in range((ox + left) // size, (ox + left + width - 1) // size + 1):
+            for cy in range((oy + top) // size, (oy + top + height - 1) // size + 1):
+                chunk = self.get_chunk(cx, cy)
+                if chunk is not None:
+                    surface.blit(chunk, (cx * size - ox, cy * size - oy))
+                    blits += 1
+        if area is not None:
+            surface.set_clip(clip)
+        return blits
+
+    def _tile_overhang(self):
+        # Tiles bigger than the grid overlap their neighbours, and alpha
+        # blending overlapping tiles onto a transparent chunk doesn't give
+        # the same pixels as blending them onto the screen one by one.
+        tiles = [self.cells.tile(gid) for gid in set(self.cells.gids) if gid]
+        tiles.extend(cell.tile for cell in self.cells._cells.values())
+        over_w = over_h = 0
+        for tile in tiles:
+            w, h = tile.surface.get_size()
+            over_w = max(over_w, w - self.tile_width)
+            over_h = max(over_h, h - self.tile_height)
+        return over_w, over_h
+
+    def get_chunk(self, cx, cy):
+        '''Return the pre-rendered surface for chunk (cx, cy), rendering it if
+        needed.
+
+        Return None if no tiles are on the chunk.
+        '''
+        key = cx, cy
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+            return self._chunks[key]
+
+        size = self.chunk_size
+        x0, y0 = cx * size, cy * size
+        if x0 >= self.px_width or y0 >= self.px_height or x0 + size <= 0 or y0 + size <= 0:
+            return None
+
+        chunk = None
+        tile_at = self.cells.tile_at
+        for i in range(max(0, x0 // self.tile_width),
+                min(self.width, (x0 + size - 1) // self.tile_width + 1)):
+            for j in range(max(0, y0 // self.tile_height),
+                    min(self.height, (y0 + size - 1) // self.tile_height + 1)):
+                tile = tile_at(i, j)
+                if tile is None:
+                    continue
+                if chunk is None:
+                    chunk = pygame.Surface((size, size), pygame.SRCALPHA)
+                    chunk.fill((0, 0, 0, 0))
+                chunk.blit(tile.surface, (i * self.tile_width - x0,
+                        j * self.tile_height - y0))
+
+        self._chunks[key] = chunk
+        while len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def invalidate(self, rect=None):
+        '''Throw away the pre-rendered chunks touching the map-space pixel
+        rect, or every chunk if rect is None.
+        '''
+        self.version += 1
+        if rect is None:
+            self._chunks.clear()
+            self._overhang = None
+            return
+        size = self.chunk_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                self._chunks.pop((cx, cy), None)
+
+    def draw_tiles(self, surface, area=None):
+        '''Draw this layer one tile at a time, without using the chunk cache.
+
+        If area (a Rect in surface coordinates) is given, only the tiles
+        that reach into it are drawn, clipped to it.
         '''
         ox, oy = self.position
         w, h = self.view_w, self.view_h
+        tile_at = self.cells.tile_at
+        if area is not None:
+            clip = surface.get_clip()
+            surface.set_clip(area)
+        blits = 0
         for x in range(ox, ox + w + self.tile_width, self.tile_width):
             i = x // self.tile_width
+            if not 0 <= i < self.width:
+                continue
+            sx = i * self.tile_width - ox
+            if area is not None and sx >= area.right:
+                continue
             for y in range(oy, oy + h + self.tile_height, self.tile_height):
                 j = y // self.tile_height
-                if (i, j) not in self.cells:
+                if not 0 <= j < self.height:
+                    continue
+                sy = j * self.tile_height - oy
+                if area is not None and sy >= area.bottom:
+                    continue
+                tile = tile_at(i, j)
+                if tile is None:
                     continue
-                cell = self.cells[i, j]
-                surface.blit(cell.tile.surface, (cell.px - ox, cell.py - oy))
+                if area is not None:
+                    tw, th = tile.surface.get_size()
+                    if sx + tw <= area.left or sy + th <= area.top:
+                        continue
+                surface.blit(tile.surface, (sx, sy))
+                blits += 1
+        if area is not None:
+            surface.set_clip(clip)
+        return blits
 
     def find(self, *properties):
         '''Find all cells with the given properties set.
         '''
         r = []
         for propname in properties:
-            for cell in list(self.cells.values()):
-                if cell and propname in cell:
+            for pos in self.cells.positions_with(propname):
+                cell = self.cells[pos]
+                if propname in cell:
                     r.append(cell)
         return r
 
@@ -393,7 +715,8 @@ class Layer(object):
         '''
         r = []
         for propname in properties:
-            for cell in list(self.cells.values()):
+            for pos in self.cells.positions_with(propname):
+                cell = self.cells[pos]
                 if propname not in cell:
                     continue
                 if properties[propname] == cell[propname]:
@@ -404,6 +727,7 @@ class Layer(object):
         '''Find all cells the rect is touching that have the indicated property
         name set.
         '''
+        self.queries += 1
         r = []
         for cell in self.get_in_region(rect.left, rect.top, rect.right,
                 rect.bottom):
@@ -420,14 +744,21 @@ class Layer(object):
 
         Return a list of Cell instances.
         '''
-        i1 = max(0, x1 // self.tile_width)
-        j1 = max(0, y1 // self.tile_height)
-        i2 = min(self.width, x2 // self.tile_width + 1)
-        j2 = min(self.height, y2 // self.tile_height + 1)
-        return [self.cells[i, j]
-            for i in range(int(i1), int(i2))
-                for j in range(int(j1), int(j2))
-                    if (i, j) in self.cells]
+        i1 = int(max(0, x1 // self.tile_width))
+        j1 = int(max(0, y1 // self.tile_height))
+        i2 = int(min(self.width, x2 // self.tile_width + 1))
+        j2 = int(min(self.height, y2 // self.tile_height + 1))
+        cells = self.cells
+        created = cells._cells
+        width = self.width
+        r = []
+        for i in range(i1, i2):
+            # slice the column out of the row-major gid array.
+            column = cells.gids[j1 * width + i:j2 * width + i:width] if j2 > j1 else ()
+            for j, gid in enumerate(column, j1):
+                if gid or created and (i, j) in created:
+                    r.append(cells[i, j])
+        return r
 
     def get_at(self, x, y):
         '''Return the cell at the nominated (x, y) coordinate.
@@ -470,6 +801,9 @@ class Object(object):
         name: The name of the object. An arbitrary string.
         gid: A reference to a tile (optional).
         visible: Whether the object is shown (1) or hidden (0). Defaults to 1.
+
+    Setting or deleting a property through item access tells the object's
+    ObjectLayer (if any), so the layer's per-property indexes stay in sync.
     """
     def __init__(self, object_type, x, y, width=0, height=0, name=None,
             gid=None, tile=None, visible=1):
@@ -491,6 +825,8 @@ class Object(object):
         self.tile = tile
         self.visible = visible
         self.properties = {}
+        # the ObjectLayer this object belongs to; set by the layer.
+        self.layer = None
 
         self._added_properties = {}
         self._deleted_properties = set()
@@ -523,19 +859,34 @@ class Object(object):
 
     def __setitem__(self, key, value):
         self._added_properties[key] = value
+        if self.layer is not None:
+            self.layer._property_changed(self, key)
 
     def __delitem__(self, key):
         self._deleted_properties.add(key)
+        if self.layer is not None:
+            self.layer._property_changed(self, key)
+
+    def property_names(self):
+        '''Return the set of property names that are set on this object.
+        '''
+        names = set(self._added_properties) | set(self.properties)
+        if self.tile:
+            names |= set(self.tile.properties)
+        return names - self._deleted_properties
 
     def draw(self, surface, view_x, view_y):
+        '''Draw the object; return True if its tile was blitted.
+        '''
         if not self.visible:
-            return
+            return False
         x, y = (self.px - view_x, self.py - view_y)
         if self.tile:
             surface.blit(self.tile.surface, (x, y))
-        else:
-            r = pygame.Rect((x, y), (self.width, self.height))
-            pygame.draw.rect(surface, (255, 100, 100), r, 2)
+            return True
+        r = pygame.Rect((x, y), (self.width, self.height))
+        pygame.draw.rect(surface, (255, 100, 100), r, 2)
+        return False
 
     @classmethod
     def fromxml(cls, tag, level):
@@ -580,6 +931,71 @@ class Object(object):
             return False
         return True
 
+    def contains(self, x, y):
+        '''Determine whether the map-space pixel (x, y) is inside this object.
+        '''
+        return self.intersects(x, y, x, y)
+
+
+class ObjectIndex(object):
+    '''A uniform grid of square buckets over the objects of an ObjectLayer.
+
+    Every object is filed in each bucket its bounds touch, so a region query
+    only has to look at the objects in the buckets the region touches
+    instead of every object in the layer.
+
+    Args
+        bucket_size: the width and height of a bucket in pixels.
+        order: a dict mapping each object to its position in the layer.  It's
+               used to return query results in the same order a linear scan
+               over the layer would.
+    '''
+    def __init__(self, bucket_size, order):
+        self.bucket_size = bucket_size
+        self.order = order
+        self.buckets = {}
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _keys(self, x1, y1, x2, y2):
+        size = self.bucket_size
+        i1, i2 = int(min(x1, x2) // size), int(max(x1, x2) // size)
+        j1, j2 = int(min(y1, y2) // size), int(max(y1, y2) // size)
+        return [(i, j) for i in range(i1, i2 + 1) for j in range(j1, j2 + 1)]
+
+    def add(self, obj):
+        keys = self._keys(obj.px, obj.py, obj.px + obj.width, obj.py + obj.height)
+        self.keys[obj] = keys
+        for key in keys:
+            self.buckets.setdefault(key, []).append(obj)
+
+    def remove(self, obj):
+        for key in self.keys.pop(obj, ()):
+            bucket = self.buckets[key]
+            bucket.remove(obj)
+            if not bucket:
+                del self.buckets[key]
+
+    def query(self, x1, y1, x2, y2):
+        '''Return the objects intersecting the given region, in layer order.
+        '''
+        keys = self._keys(x1, y1, x2, y2)
+        if len(keys) > len(self.keys):
+            # the region is huge compared to the number of objects; checking
+            # every object is cheaper than walking the buckets.
+            found = self.keys
+        else:
+            found = set()
+            for key in keys:
+                bucket = self.buckets.get(key)
+                if bucket:
+                    found.update(bucket)
+        r = [obj for obj in found if obj.intersects(x1, y1, x2, y2)]
+        r.sort(key=self.order.__getitem__)
+        return r
+
 
 class ObjectLayer(object):
     '''A layer composed of basic primitive shapes.
@@ -595,9 +1011,22 @@ class ObjectLayer(object):
         opacity - the opacity of the layer as a value from 0 to 1.
         visible - whether the layer is shown (1) or hidden (0).
         objects - the objects in this Layer (Object instances)
+
+    Region queries (collide(), get_in_region() and get_at()) go through a
+    spatial index of the objects.  On top of that, every property name gets
+    its own index holding only the objects that have that property, so e.g.
+    collide(rect, 'blockers') never looks at spawn points or exit markers.
+    Use add_object(), remove_object() and move_object() to change the
+    layer's objects so the indexes stay current; if self.objects (or an
+    object's properties dict) is changed directly, call reindex() afterwards.
+    version goes up whenever the indexes change, so anything built from the
+    layer's objects can tell when it has to be built again.
+
+    draw() returns the number of blits it made, and queries counts the calls
+    to collide() and get_in_region(), for profiling.
     '''
     def __init__(self, name, color, objects, opacity=1,
-            visible=1, position=(0, 0)):
+            visible=1, position=(0, 0), bucket_size=OBJECT_BUCKET_SIZE):
         self.name = name
         self.color = color
         self.objects = objects
@@ -605,6 +1034,10 @@ class ObjectLayer(object):
         self.visible = visible
         self.position = position
         self.properties = {}
+        self.bucket_size = bucket_size
+        self.queries = 0
+        self.version = 0
+        self.reindex()
 
     def __repr__(self):
         return '<ObjectLayer "%s" at 0x%x>' % (self.name, id(self))
@@ -625,8 +1058,80 @@ class ObjectLayer(object):
             if value.isdigit():
                 value = int(value)
             layer.properties[name] = value
+        layer.reindex()
         return layer
 
+    def reindex(self):
+        '''Rebuild the spatial index from scratch out of self.objects.
+        '''
+        self._order = {}
+        self._index = ObjectIndex(self.bucket_size, self._order)
+        self._by_property = {}
+        for obj in self.objects:
+            self._order[obj] = len(self._order)
+            self._add_to_indexes(obj)
+        self._next_order = len(self._order)
+        self.version += 1
+
+    def _property_index(self, propname):
+        try:
+            return self._by_property[propname]
+        except KeyError:
+            index = ObjectIndex(self.bucket_size, self._order)
+            self._by_property[propname] = index
+            return index
+
+    def _add_to_indexes(self, obj):
+        self.version += 1
+        obj.layer = self
+        self._index.add(obj)
+        for propname in obj.property_names():
+            self._property_index(propname).add(obj)
+
+    def _remove_from_indexes(self, obj):
+        self.version += 1
+        self._index.remove(obj)
+        for index in self._by_property.values():
+            index.remove(obj)
+
+    def _property_changed(self, obj, propname):
+        '''Called by obj when one of its properties is set or deleted.
+        '''
+        self.version += 1
+        index = self._property_index(propname)
+        indexed = obj in index.keys
+        if propname in obj:
+            if not indexed:
+                index.add(obj)
+        elif indexed:
+            index.remove(obj)
+
+    def add_object(self, obj):
+        '''Append obj to the layer's objects and index it.
+        '''
+        self.objects.append(obj)
+        self._order[obj] = self._next_order
+        self._next_order += 1
+        self._add_to_indexes(obj)
+
+    def remove_object(self, obj):
+        '''Remove obj from the layer's objects and from the index.
+        '''
+        self.objects.remove(obj)
+        self._remove_from_indexes(obj)
+        del self._order[obj]
+        obj.layer = None
+
+    def move_object(self, obj, x, y):
+        '''Move obj so its top left corner is at the map-space pixel (x, y).
+        '''
+        self._remove_from_indexes(obj)
+        obj.px = obj.left = x
+        obj.py = obj.top = y
+        obj.right = x + obj.width
+        obj.bottom = y + obj.height
+        self._add_to_indexes(obj)
+
     def update(self, dt, *args):
         pass
 
@@ -637,22 +1142,37 @@ class ObjectLayer(object):
         y -= viewport_oy
         self.position = (x, y)
 
-    def draw(self, surface):
+    def draw(self, surface, area=None):
         '''Draw this layer, limited to the current viewport, to the Surface.
+
+        If area (a Rect in surface coordinates) is given, drawing is
+        clipped to it.
         '''
         if not self.visible:
-            return
+            return 0
+        if area is not None:
+            clip = surface.get_clip()
+            surface.set_clip(area)
+        blits = 0
         for obj in self.objects:
-            obj.draw(surface, self.view_x, self.view_y)
+            if obj.draw(surface, self.view_x, self.view_y):
+                blits += 1
+        if area is not None:
+            surface.set_clip(clip)
+        return blits
 
     def find(self, *properties):
         '''Find all cells with the given properties set.
         '''
+        if len(self._index) != len(self.objects):
+            self.reindex()
         r = []
         for propname in properties:
-            for obj in self.objects:
-                if obj and propname in obj or propname in self.properties:
-                    r.append(obj)
+            if propname in self.properties:
+                r.extend(self.objects)
+            elif propname in self._by_property:
+                index = self._by_property[propname]
+                r.extend(sorted(index.keys, key=self._order.__getitem__))
         return r
 
     def match(self, **properties):
@@ -675,12 +1195,18 @@ class ObjectLayer(object):
         '''Find all objects the rect is touching that have the indicated
         property name set.
         '''
-        r = []
-        for obj in self.get_in_region(rect.left, rect.top, rect.right,
-                rect.bottom):
-            if propname in obj or propname in self.properties:
-                r.append(obj)
-        return r
+        self.queries += 1
+        if len(self._index) != len(self.objects):
+            self.reindex()
+        if propname in self.properties:
+            # every object inherits the layer's properties.
+            return self._index.query(rect.left, rect.top, rect.right,
+                    rect.bottom)
+        try:
+            index = self._by_property[propname]
+        except KeyError:
+            return []
+        return index.query(rect.left, rect.top, rect.right, rect.bottom)
 
     def get_in_region(self, x1, y1, x2, y2):
         '''Return objects that are within the map-space
@@ -689,22 +1215,58 @@ class ObjectLayer(object):
 
         Return a list of Object instances.
         '''
-        return [obj for obj in self.objects if obj.intersects(x1, y1, x2, y2)]
+        self.queries += 1
+        if len(self._index) != len(self.objects):
+            self.reindex()
+        return self._index.query(x1, y1, x2, y2)
 
     def get_at(self, x, y):
         '''Return the first obj found at the nominated (x, y) coordinate.
 
         Return an Object instance or None.
         '''
-        for obj in self.objects:
-            if obj.contains(x,y):
+        for obj in self.get_in_region(x, y, x, y):
+            if obj.contains(x, y):
                 return obj
 
 
 class SpriteLayer(pygame.sprite.AbstractGroup):
-    def __init__(self):
+    '''A layer of sprites, drawn at their rect positions.
+
+    If interpolation is set to a number between 0 and 1, sprites are drawn
+    that far between the positions saved by the last call to
+    remember_positions() and their current rects instead.
+
+    After draw(), drawn holds the screen rects the sprites were drawn in.
+    '''
+    def __init__(self, name='sprites'):
         super(SpriteLayer, self).__init__()
+        self.name = name
         self.visible = True
+        self.interpolation = None
+        self.drawn = []
+
+    def collide(self, rect):
+        '''Return the sprites that collide with rect, in layer order.
+        '''
+        return [sprite for sprite in self if rect.colliderect(sprite.rect)]
+
+    def remember_positions(self):
+        '''Save every sprite's current position for interpolation.
+        '''
+        for sprite in self.sprites():
+            sprite.previous_position = sprite.rect.topleft
+
+    def interpolated_position(self, sprite):
+        '''Return the position sprite should be drawn at.
+        '''
+        x, y = sprite.rect.topleft
+        previous = getattr(sprite, 'previous_position', None)
+        alpha = self.interpolation
+        if alpha is None or previous is None:
+            return x, y
+        px, py = previous
+        return int(px + (x - px) * alpha), int(py + (y - py) * alpha)
 
     def set_view(self, x, y, w, h, viewport_ox=0, viewport_oy=0):
         self.view_x, self.view_y = x, y
@@ -718,13 +1280,16 @@ class SpriteLayer(pygame.sprite.AbstractGroup):
     def draw(self, screen):
         ox, oy = self.position
 
-        for sprite in self.sprites():
-            sx, sy = sprite.rect.topleft
+        sprites = self.sprites()
+        drawn = self.drawn = []
+        for sprite in sprites:
+            sx, sy = self.interpolated_position(sprite)
             # Only the sprite's defined width and height will be drawn
             area = pygame.Rect((0, 0),
                                (sprite.rect.width,
                                 sprite.rect.height))
-            screen.blit(sprite.image, (sx-ox, sy-oy), area)
+            drawn.append(screen.blit(sprite.image, (sx-ox, sy-oy), area))
+        return len(sprites)
 
 class Layers(list):
     def __init__(self):
@@ -764,6 +1329,12 @@ class TileMap(object):
         view_w, view_h - viewport size
         view_x, view_y - viewport offset (origin)
         viewport - a Rect instance giving the current viewport specification
+        profiler - None, or an object with stage(name) (a context manager
+                   timing what's inside it) and count(name, n) methods;
+                   see lib/profiler.py.  If set, update() and draw() time
+                   each layer and count blits, sprites updated and
+                   collision queries.  Renderers that draw the layers
+                   themselves go through draw_layer() to get the same.
 
     '''
     def __init__(self, size, origin=(0,0)):
@@ -780,18 +1351,67 @@ class TileMap(object):
         self.view_w, self.view_h = size     # viewport size
         self.view_x, self.view_y = origin   # viewport offset
         self.viewport = Rect(origin, size)
+        self.profiler = None
 
     def update(self, dt, *args):
+        if self.profiler is not None:
+            return self._profiled_update(dt, *args)
         for layer in self.layers:
             layer.update(dt, *args)
 
     def draw(self, screen):
+        if self.profiler is not None:
+            return self._profiled_draw(screen)
         for layer in self.layers:
             if layer.visible:
                 layer.draw(screen)
 
+    def query_count(self):
+        '''Return the number of collision queries made on all the layers.
+        '''
+        return sum(getattr(layer, 'queries', 0) for layer in self.layers)
+
+    def _profiled_update(self, dt, *args):
+        profiler = self.profiler
+        queries = self.query_count()
+        for layer in self.layers:
+            if isinstance(layer, SpriteLayer):
+                profiler.count('sprites updated', len(layer))
+            with profiler.stage('update ' + layer.name):
+                layer.update(dt, *args)
+        profiler.count('collision queries', self.query_count() - queries)
+
+    def _profiled_draw(self, screen):
+        for layer in self.layers:
+            if layer.visible:
+                self.draw_layer(layer, screen)
+
+    def draw_layer(self, layer, surface, *args):
+        '''Draw one layer on surface (passing on any other arguments its
+        draw() takes), timing it and counting its blits like draw() does if
+        there's a profiler.  Return what the layer's draw() did.
+        '''
+        profiler = self.profiler
+        if profiler is None:
+            return layer.draw(surface, *args)
+        with profiler.stage('draw ' + layer.name):
+            blits = layer.draw(surface, *args)
+            profiler.count('blits', blits or 0)
+        return blits
+
     @classmethod
-    def load(cls, filename, viewport):
+    def load(cls, filename, viewport, cache=False):
+        '''Load a TileMap from a TMX file.
+
+        If cache is True, a compiled copy of the map is kept next to the TMX
+        file (see save_cache()) and used instead of parsing the XML whenever
+        the TMX file hasn't changed since the cache was written.
+        '''
+        if cache:
+            tilemap = cls.load_cache(filename, viewport)
+            if tilemap is not None:
+                return tilemap
+
         with open(filename) as f:
             level = ElementTree.fromstring(f.read())
 
@@ -820,6 +1440,154 @@ class TileMap(object):
             layer = ObjectLayer.fromxml(tag, tilemap)
             tilemap.layers.add_named(layer, layer.name)
 
+        if cache:
+            tilemap.save_cache(filename)
+        return tilemap
+
+    def save_cache(self, filename):
+        '''Write a compiled copy of this map, which was loaded from filename,
+        to filename + CACHE_SUFFIX.
+
+        The cache holds the map's header and properties, the tilesets (image
+        paths and tile properties), every tile layer's gids as raw
+        little-endian uint32s and every object layer's objects.  It is keyed
+        on the size, mtime and sha1 of filename.  Failing to write the cache
+        is not an error; the map just gets parsed again next time.
+        '''
+        tilesets = {}
+        for tile in self.tilesets.values():
+            tilesets[id(tile.tileset)] = tile.tileset
+        tilesets = sorted(tilesets.values(), key=lambda t: t.firstgid)
+
+        layers = []
+        blob = []
+        offset = 0
+        for layer in self.layers:
+            if isinstance(layer, Layer):
+                gids = array('I', layer.cells.gids)
+                if sys.byteorder == 'big':
+                    gids.byteswap()
+                data = gids.tobytes()
+                layers.append(('layer', layer.name, layer.visible, offset,
+                        len(data)))
+                blob.append(data)
+                offset += len(data)
+            elif isinstance(layer, ObjectLayer):
+                objects = []
+                for obj in layer.objects:
+                    y = obj.py + obj.tile.tile_height if obj.tile else obj.py
+                    objects.append((obj.type, obj.px, y, obj.width,
+                            obj.height, obj.name, obj.gid, obj.visible,
+                            obj.properties))
+                layers.append(('objectgroup', layer.name, layer.color,
+                        layer.opacity, layer.visible, layer.properties,
+                        objects))
+
+        meta = {
+            'size': (self.width, self.height, self.tile_width,
+                     self.tile_height),
+            'properties': self.properties,
+            'tilesets': [(t.name, t.tile_width, t.tile_height, t.firstgid,
+                          t.images, dict((i, t.tiles[i].properties)
+                              for i in range(len(t.tiles))
+                                  if t.tiles[i].properties))
+                         for t in tilesets],
+            'layers': layers,
+        }
+        meta = marshal.dumps(meta)
+
+        cache_file = filename + CACHE_SUFFIX
+        try:
+            size, mtime, digest = _source_key(filename)
+            header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, size,
+                    mtime, digest, len(meta))
+            tmp = cache_file + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(meta)
+                for data in blob:
+                    f.write(data)
+            os.replace(tmp, cache_file)
+        except (IOError, OSError):
+            pass
+
+    @classmethod
+    def load_cache(cls, filename, viewport):
+        '''Load the map from filename's compiled cache.
+
+        Return None if there is no cache, or it's out of date or unreadable.
+        '''
+        cache_file = filename + CACHE_SUFFIX
+        try:
+            with open(cache_file, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            magic, version, size, mtime, digest, meta_len = \
+                    CACHE_HEADER.unpack_from(data)
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                return None
+            stat = os.stat(filename)
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                # the file was touched; it's only stale if it changed.
+                if _source_key(filename)[2] != digest:
+                    return None
+            start = CACHE_HEADER.size
+            meta = marshal.loads(data[start:start + meta_len])
+            blob = memoryview(data)[start + meta_len:]
+            try:
+                return cls._fromcache(meta, blob, viewport)
+            finally:
+                blob.release()
+        except (struct.error, ValueError, EOFError, TypeError, KeyError,
+                IOError, OSError):
+            return None
+        finally:
+            data.close()
+
+    @classmethod
+    def _fromcache(cls, meta, blob, viewport):
+        tilemap = TileMap(viewport)
+        (tilemap.width, tilemap.height, tilemap.tile_width,
+                tilemap.tile_height) = meta['size']
+        tilemap.px_width = tilemap.width * tilemap.tile_width
+        tilemap.px_height = tilemap.height * tilemap.tile_height
+        tilemap.properties = meta['properties']
+
+        for name, tile_width, tile_height, firstgid, images, tile_properties \
+                in meta['tilesets']:
+            tileset = Tileset(name, tile_width, tile_height, firstgid)
+            for image in images:
+                tileset.add_image(image)
+            for i, properties in tile_properties.items():
+                tileset.tiles[i].properties = properties
+            tilemap.tilesets.add(tileset)
+
+        for entry in meta['layers']:
+            if entry[0] == 'layer':
+                _, name, visible, offset, length = entry
+                layer = Layer(name, visible, tilemap)
+                gids = array('I')
+                gids.frombytes(blob[offset:offset + length])
+                if sys.byteorder == 'big':
+                    gids.byteswap()
+                layer.cells.gids = gids
+            else:
+                _, name, color, opacity, visible, properties, objects = entry
+                layer = ObjectLayer(name, color, [], opacity, visible)
+                layer.properties = properties
+                for (object_type, x, y, width, height, obj_name, gid,
+                        obj_visible, obj_properties) in objects:
+                    tile = tilemap.tilesets[gid] if gid is not None else None
+                    obj = Object(object_type, x, y, width, height, obj_name,
+                            gid, tile, obj_visible)
+                    obj.properties = obj_properties
+                    layer.objects.append(obj)
+                layer.reindex()
+            tilemap.layers.add_named(layer, layer.name)
+
         return tilemap
 
     _old_focus = None
@@ -933,8 +1701,16 @@ class TileMap(object):
         sx, sy = self.pixel_from_screen(x, y)
         return int(sx//self.tile_width), int(sy//self.tile_height)
 
-def load(filename, viewport):
-    return TileMap.load(filename, viewport)
+def _source_key(filename):
+    '''Return the (size, mtime in ns, sha1 digest) of a file.
+    '''
+    stat = os.stat(filename)
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha1(f.read()).digest()
+    return stat.st_size, stat.st_mtime_ns, digest
+
+def load(filename, viewport, cache=False):
+    return TileMap.load(filename, viewport, cache)
 
 if __name__ == '__main__':
     # Initialize pygame and create a 500x500 display.